@@ -0,0 +1,303 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import tracing
+from final_version import read_bff_file, write_atomic, solution_text, use_cache_directory, BffFormatError
+
+# Records kept in memory before they are written out
+FLUSH_EVERY = 64
+
+# Longest time a finished record waits before it is written out, in seconds
+FLUSH_INTERVAL = 1.0
+
+# Seconds between checks of the flush policy while waiting for results
+POLL_INTERVAL = 0.1
+
+
+class JsonlSink:
+    '''
+    Writes one JSON record per line to a single stream file.
+
+    Records are buffered and written as whole lines once FLUSH_EVERY of them
+    are waiting or FLUSH_INTERVAL seconds have passed since the last write,
+    so a reader following the file while the batch runs (e.g. tail -f) only
+    ever sees complete records.
+    '''
+
+    def __init__(self, path, flush_every=FLUSH_EVERY, flush_interval=FLUSH_INTERVAL, fsync=False):
+        '''
+        Opens the stream.
+
+        Parameters
+        ----------
+        path : str
+            The file to write; '-' writes to stdout.
+        flush_every : int, optional
+            Number of records buffered before they are written.
+        flush_interval : float, optional
+            Seconds a buffered record may wait before it is written.
+        fsync : bool, optional
+            Also sync each write to disk.
+
+        Returns
+        -------
+        None.
+        '''
+        self.file = sys.stdout if path == '-' else open(path, 'w')
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffer = []
+        self.last = time.monotonic()
+
+    def write(self, record):
+        '''
+        Adds a record, writing out the buffer if the flush policy says so.
+
+        Parameters
+        ----------
+        record : dict
+
+        Returns
+        -------
+        None.
+        '''
+        self.buffer.append(json.dumps(record) + '\n')
+        if len(self.buffer) >= self.flush_every or time.monotonic() - self.last >= self.flush_interval:
+            self.flush()
+
+    def tick(self):
+        '''
+        Writes out the buffer if its oldest record has waited long enough.
+        Called while the batch waits for results.
+
+        Returns
+        -------
+        None.
+        '''
+        if self.buffer and time.monotonic() - self.last >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes out the buffered records.
+
+        Returns
+        -------
+        None.
+        '''
+        with tracing.span('flush', records=len(self.buffer)):
+            if self.buffer:
+                self.file.write(''.join(self.buffer))
+                self.buffer.clear()
+            self.file.flush()
+            if self.fsync and self.file is not sys.stdout:
+                os.fsync(self.file.fileno())
+        self.last = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FileSink:
+    '''
+    Writes each record as files of its own: the '_solution.txt' that
+    printAns writes and a '_result.json' with the whole record. Each file
+    is written atomically, so a killed batch leaves no partial files.
+    '''
+
+    def __init__(self, directory=None):
+        '''
+        Parameters
+        ----------
+        directory : str, optional
+            Where to write the files; defaults to next to each puzzle.
+
+        Returns
+        -------
+        None.
+        '''
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, record):
+        '''
+        Writes the files of one record.
+
+        Parameters
+        ----------
+        record : dict
+
+        Returns
+        -------
+        None.
+        '''
+        base = os.path.splitext(record['name'])[0]
+        if self.directory:
+            base = os.path.join(self.directory, os.path.basename(base))
+        with tracing.span('write', puzzle=record['name']):
+            if 'error' not in record:
+                write_atomic(base + '_solution.txt', solution_text(record['grid']))
+            write_atomic(base + '_result.json', json.dumps(record) + '\n')
+
+    def tick(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordSink:
+    '''
+    Keeps the records written to it, for a worker process to send back to
+    the sink of the batch.
+    '''
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+def solve_file(file_path):
+    '''
+    Reads and solves one puzzle in a worker process.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the '.bff' file.
+
+    Returns
+    -------
+    record : dict
+        The record of the solve, with read and search times, or the
+        error if the file could not be read.
+    events : list of dict
+        The trace events of the solve, if tracing is enabled.
+    '''
+    from planner import plan_solution
+
+    with tracing.span('puzzle', puzzle=file_path):
+        t0 = time.time()
+        try:
+            puzzle = read_bff_file(file_path)
+        except (OSError, UnicodeDecodeError, BffFormatError) as exc:
+            return {'name': file_path, 'error': str(exc)}, tracing.drain()
+        t1 = time.time()
+        sink = RecordSink()
+        plan_solution(puzzle, file_path, processes=1).solve(sink)
+    record, = sink.records
+    record['times'] = {'read': t1 - t0, 'search': record['stats']['search_time']}
+    return record, tracing.drain()
+
+
+def _init_worker(trace, cache_directory):
+    if trace:
+        tracing.enable()
+    use_cache_directory(cache_directory)
+
+
+def solve_batch(file_paths, sink, processes=None, trace_path=None, cache_directory=None):
+    '''
+    Solves many puzzles in a pool of worker processes, writing each
+    record to the sink as it finishes.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        Paths to '.bff' files.
+    sink : JsonlSink or FileSink
+        Where the records go.
+    processes : int, optional
+        Number of worker processes; defaults to the CPU count.
+    trace_path : str, optional
+        Write a Chrome Trace Event file of the run here.
+    cache_directory : str, optional
+        Share the compiled laser tables of each grid size and geometry
+        between the workers, and with later runs, through files here.
+
+    Returns
+    -------
+    dict
+        How many puzzles were solved, unsolved and unreadable.
+    '''
+    counts = {'solved': 0, 'unsolved': 0, 'errors': 0}
+    events = []
+    if trace_path:
+        tracing.enable()
+    with multiprocessing.Pool(processes, _init_worker, (bool(trace_path), cache_directory)) as pool:
+        results = pool.imap_unordered(solve_file, file_paths)
+        while True:
+            try:
+                record, trace = results.next(timeout=POLL_INTERVAL)
+            except multiprocessing.TimeoutError:
+                sink.tick()
+                continue
+            except StopIteration:
+                break
+            events.extend(trace)
+            sink.write(record)
+            if 'error' in record:
+                counts['errors'] += 1
+            else:
+                counts['solved' if record['solved'] else 'unsolved'] += 1
+    if trace_path:
+        sink.flush()
+        tracing.write_trace(trace_path, events + tracing.drain())
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve many .bff files, streaming the results.')
+    parser.add_argument('paths', nargs='+', help='.bff files, or directories of them')
+    out = parser.add_mutually_exclusive_group(required=True)
+    out.add_argument('--jsonl', help="write one JSON line per puzzle to this file ('-' for stdout)")
+    out.add_argument('--files', nargs='?', const='', metavar='DIRECTORY',
+                     help='write per-puzzle files, next to each puzzle by default')
+    parser.add_argument('--flush-every', type=int, default=FLUSH_EVERY)
+    parser.add_argument('--flush-interval', type=float, default=FLUSH_INTERVAL)
+    parser.add_argument('--fsync', action='store_true', help='sync the stream to disk on each flush')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--trace', help='write a Chrome Trace Event file of the run')
+    parser.add_argument('--cache', metavar='DIRECTORY',
+                        help='cache compiled laser tables here for workers and later runs')
+    args = parser.parse_args()
+
+    file_paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            file_paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                              if name.endswith('.bff'))
+        else:
+            file_paths.append(path)
+    if args.jsonl:
+        sink = JsonlSink(args.jsonl, args.flush_every, args.flush_interval, args.fsync)
+    else:
+        sink = FileSink(args.files or None)
+    t0 = time.time()
+    with sink:
+        counts = solve_batch(file_paths, sink, args.processes, args.trace, args.cache)
+    print(f"{counts} in {time.time() - t0:.2f} seconds", file=sys.stderr)
@@ -0,0 +1,257 @@
+import os
+import sys
+import mmap
+import struct
+from final_version import read_bff_files, BffFormatError, BLOCK_LETTERS
+
+# Corpus layout (all little endian):
+#   file header   : magic, version, block type count, puzzle count
+#   offset table  : one uint64 file offset per puzzle
+#   each record   : width, height, laser count, target count, name length (uint16),
+#                   one uint16 count per block type, in BLOCK_LETTERS order,
+#                   grid cells as bytes in grid[x][y] order, padded to an even length,
+#                   lasers as int16 (x, y, vx, vy), targets as int16 (x, y),
+#                   file name in UTF-8, padded to a multiple of 8 bytes
+MAGIC = b'LZRC'
+VERSION = 2
+FILE_HEADER = struct.Struct('<4sHHI')
+RECORD_HEADER = struct.Struct('<5H')
+OFFSETS_START = 16
+
+
+def pack_puzzle(name, puzzle):
+    '''
+    Packs one puzzle into a corpus record.
+
+    Parameters
+    ----------
+    name : str
+        The puzzle's file name.
+    puzzle : tuple
+        The grid, block counts, lasers and targets from read_bff_file.
+
+    Raises
+    ------
+    ValueError
+        If a value does not fit in the record's integer fields.
+
+    Returns
+    -------
+    bytes
+        The record.
+    '''
+    grid, blocks, lasers, points = puzzle
+    if len(blocks) > len(BLOCK_LETTERS):
+        raise ValueError(f"{name}: more block counts than registered block types")
+    encoded_name = name.encode('utf-8')
+    header = RECORD_HEADER.pack(len(grid), len(grid[0]), len(lasers), len(points), len(encoded_name))
+    counts = list(blocks) + [0] * (len(BLOCK_LETTERS) - len(blocks))
+    header += struct.pack(f'<{len(counts)}H', *counts)
+    cells = ''.join(cell for col in grid for cell in col).encode('ascii')
+    if len(cells) % 2:
+        cells += b'\0'
+    numbers = [value for laser in lasers for value in laser] + [value for point in points for value in point]
+    if any(not -32768 <= value <= 32767 for value in numbers):
+        raise ValueError(f"{name}: positions do not fit in 16 bits")
+    record = header + cells + struct.pack(f'<{len(numbers)}h', *numbers) + encoded_name
+    return record + b'\0' * (-len(record) % 8)
+
+
+def compile_corpus(file_paths, corpus_path):
+    '''
+    Compiles '.bff' files into one packed corpus file.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        Paths to '.bff' files, or a single directory holding them.
+    corpus_path : str
+        Path of the corpus file to write.
+
+    Raises
+    ------
+    BffFormatError
+        If any of the files is malformed; no corpus is written then.
+
+    Returns
+    -------
+    int
+        Number of puzzles written.
+    '''
+    if isinstance(file_paths, str):
+        file_paths = [os.path.join(file_paths, name) for name in sorted(os.listdir(file_paths))
+                      if name.endswith('.bff')]
+    puzzles, errors = read_bff_files(file_paths)
+    if errors:
+        raise BffFormatError('; '.join(str(exc) for exc in errors.values()))
+
+    records = [pack_puzzle(os.path.basename(path), puzzles[path]) for path in file_paths]
+    offset = OFFSETS_START + 8 * len(records)
+    offsets = []
+    for record in records:
+        offsets.append(offset)
+        offset += len(record)
+
+    with open(corpus_path, 'wb') as file:
+        file.write(FILE_HEADER.pack(MAGIC, VERSION, len(BLOCK_LETTERS), len(records)))
+        file.write(b'\0' * (OFFSETS_START - FILE_HEADER.size))
+        file.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        for record in records:
+            file.write(record)
+    return len(records)
+
+
+class Corpus:
+    '''
+    A packed corpus opened with mmap. Puzzles are decoded only when
+    they are accessed by index.
+    '''
+
+    def __init__(self, corpus_path):
+        '''
+        Opens the corpus file.
+
+        Parameters
+        ----------
+        corpus_path : str
+            Path of the corpus file.
+
+        Raises
+        ------
+        ValueError
+            If the file is not a corpus of a known version.
+
+        Returns
+        -------
+        None.
+        '''
+        with open(corpus_path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, version, self.types, count = FILE_HEADER.unpack_from(self.view, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{corpus_path} is not a version {VERSION} puzzle corpus")
+        if self.types > len(BLOCK_LETTERS):
+            self.close()
+            raise ValueError(f"{corpus_path} has {self.types} block types, more than are registered")
+        self.offsets = self.view[OFFSETS_START:OFFSETS_START + 8 * count].cast('Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Releases the memory map.
+
+        Returns
+        -------
+        None.
+        '''
+        if hasattr(self, 'offsets'):
+            self.offsets.release()
+        self.view.release()
+        self.map.close()
+
+    def record(self, index):
+        '''
+        Gets the raw fields of a puzzle as views into the memory map.
+
+        Parameters
+        ----------
+        index : int
+            Position of the puzzle in the corpus.
+
+        Returns
+        -------
+        tuple
+            The record header values, the block counts, the grid cells, the
+            lasers and targets as an int16 view, and the file name bytes.
+        '''
+        offset = self.offsets[index]
+        header = RECORD_HEADER.unpack_from(self.view, offset)
+        width, height, n_lasers, n_points, name_len = header
+        start = offset + RECORD_HEADER.size
+        blocks = list(struct.unpack_from(f'<{self.types}H', self.view, start))
+        start += 2 * self.types
+        cells = self.view[start:start + width * height]
+        start += width * height + (width * height) % 2
+        numbers = self.view[start:start + 2 * (4 * n_lasers + 2 * n_points)].cast('h')
+        start += 2 * (4 * n_lasers + 2 * n_points)
+        name = self.view[start:start + name_len]
+        return header, blocks, cells, numbers, name
+
+    def name(self, index):
+        '''
+        Gets the file name a puzzle was compiled from.
+
+        Parameters
+        ----------
+        index : int
+            Position of the puzzle in the corpus.
+
+        Returns
+        -------
+        str
+        '''
+        return bytes(self.record(index)[4]).decode('utf-8')
+
+    def __getitem__(self, index):
+        '''
+        Decodes a puzzle.
+
+        Parameters
+        ----------
+        index : int
+            Position of the puzzle in the corpus.
+
+        Returns
+        -------
+        tuple
+            The grid, block counts, lasers and targets, as read_bff_file returns them.
+        '''
+        header, blocks, cells, numbers, _ = self.record(index)
+        width, height, n_lasers, n_points, _ = header
+        text = bytes(cells).decode('ascii')
+        grid = [list(text[x * height:(x + 1) * height]) for x in range(width)]
+        lasers = [tuple(numbers[4 * i:4 * i + 4]) for i in range(n_lasers)]
+        base = 4 * n_lasers
+        points = [tuple(numbers[base + 2 * i:base + 2 * i + 2]) for i in range(n_points)]
+        numbers.release()
+        # Like read_bff_file, keep three counts unless a later type is used
+        while len(blocks) > 3 and blocks[-1] == 0:
+            blocks.pop()
+        return grid, blocks, lasers, points
+
+
+if __name__ == '__main__':
+    # Usage: python corpus.py <bff directory> <corpus file>
+    if len(sys.argv) == 3:
+        count = compile_corpus(sys.argv[1], sys.argv[2])
+        print(f"Wrote {count} puzzles to {sys.argv[2]}")
+        sys.exit()
+
+    # Test: the bundled files, and one with the later block types,
+    # round-trip exactly
+    import tempfile
+    from final_version import read_bff_file
+    base_dir = os.path.abspath('bff_files')
+    with tempfile.TemporaryDirectory() as tmp:
+        file_paths = [os.path.join(base_dir, name) for name in sorted(os.listdir(base_dir))
+                      if name.endswith('.bff')]
+        extra_path = os.path.join(tmp, 'later_types.bff')
+        with open(extra_path, 'w') as file:
+            file.write('GRID START\no o\no o\nGRID STOP\nA 1\nE 1\nL 0 1 1 1\nP 3 4\n')
+        file_paths.append(extra_path)
+        corpus_path = os.path.join(tmp, 'bff_files.lzc')
+        compile_corpus(file_paths, corpus_path)
+        with Corpus(corpus_path) as corpus:
+            same = all(corpus[i] == read_bff_file(path) for i, path in enumerate(file_paths))
+    if same:
+        print("Corpus round-trip test passed.")
@@ -0,0 +1,319 @@
+import os
+import copy
+from final_version import read_bff_file, Solution, BLOCK_LETTERS
+
+# Learned nogoods kept before the solver stops recording new ones
+MAX_NOGOODS = 100000
+
+
+class CSPSolution(Solution):
+    '''
+    Solves the puzzle as a constraint problem.
+
+    Every free cell is a variable whose value is 'o' or a block type.
+    The block counts constrain how many cells take each type, and each
+    target must be covered by the lasers. The lasers are traced through
+    the assigned cells only, and the search branches on the first
+    unassigned cell they reach.
+
+    When a target can no longer be reached, the conflict is explained by
+    the few assigned cells that actually cut the lasers off from it.
+    These explanations are learned as nogoods, and let the search jump
+    back over decisions that had nothing to do with the conflict.
+    '''
+
+    def search(self):
+        '''
+        Runs the constraint search.
+
+        Returns
+        -------
+        None.
+        '''
+        self.free = set(self.freeCells)
+        self.assign = {}
+        self.nogoods = {}
+        self.stats.update({'nogoods': 0, 'backjumps': 0, 'forced_empty': 0})
+        self.csphelper(None)
+
+    def cellValue(self, cell):
+        '''
+        Gets the value of a cell, or None if it is a free cell
+        that has not been assigned yet.
+
+        Parameters
+        ----------
+        cell : tuple
+            The (x, y) cell.
+
+        Returns
+        -------
+        str or None
+        '''
+        if cell in self.free:
+            return self.assign.get(cell)
+        return self.grid[cell[0]][cell[1]]
+
+    def expand(self, omni):
+        '''
+        Follows the lasers through the assigned cells.
+
+        With omni set to False a laser stops at the first unassigned cell.
+        With omni set to True an unassigned cell may let the laser pass and
+        reflect it, so the result covers every point any completion of the
+        current assignment could reach.
+
+        Parameters
+        ----------
+        omni : bool
+            Whether unassigned cells pass and reflect lasers.
+
+        Returns
+        -------
+        tuple
+            The set of points reached, the set of laser states visited and
+            the unassigned cells the lasers arrived at.
+        '''
+        path = set()
+        states = set()
+        frontier = set()
+        queue = list(self.laserQueue)
+        while queue:
+            laser = queue.pop()
+            if laser in states:
+                continue
+            states.add(laser)
+            x, y, dx, dy = laser
+            path.add((x, y))
+            nx, ny = x + dx, y + dy
+            if nx > self.M or ny > self.N or nx < 0 or ny < 0:
+                continue
+            cell = self.nextPassThrough(laser)
+            value = self.cellValue(cell)
+            if value is None:
+                frontier.add(cell)
+                if not omni:
+                    continue
+            if value is None or value in ('o', 'x', 'C'):
+                queue.append((nx, ny, dx, dy))
+            if value is None or value in ('A', 'C'):
+                rx = dx if nx % 2 == 0 else -dx
+                ry = dy if ny % 2 == 0 else -dy
+                queue.append((x + rx, y + ry, rx, ry))
+        return path, states, frontier
+
+    def explain(self, states):
+        '''
+        Finds the assigned cells that cut the lasers off from the missed
+        targets. A cell is needed only if an outcome it rules out would lead
+        to a laser state that was not reached anyway; freeing every other
+        cell leaves the reachable states unchanged.
+
+        Parameters
+        ----------
+        states : set
+            The laser states reachable with unassigned cells left open.
+
+        Returns
+        -------
+        set
+            The cells in the explanation.
+        '''
+        reason = set()
+        for laser in states:
+            x, y, dx, dy = laser
+            nx, ny = x + dx, y + dy
+            if nx > self.M or ny > self.N or nx < 0 or ny < 0:
+                continue
+            cell = self.nextPassThrough(laser)
+            if cell not in self.assign or cell in reason:
+                continue
+            value = self.assign[cell]
+            if value not in ('o', 'C') and (nx, ny, dx, dy) not in states:
+                reason.add(cell)
+                continue
+            rx = dx if nx % 2 == 0 else -dx
+            ry = dy if ny % 2 == 0 else -dy
+            if value not in ('A', 'C') and (x + rx, y + ry, rx, ry) not in states:
+                reason.add(cell)
+        return reason
+
+    def learn(self, reason):
+        '''
+        Records a nogood: the current values of the given cells can not
+        be part of a solution.
+
+        Parameters
+        ----------
+        reason : set
+            The cells in the nogood.
+
+        Returns
+        -------
+        None.
+        '''
+        if self.stats['nogoods'] >= MAX_NOGOODS or not reason:
+            return
+        nogood = frozenset((cell, self.assign[cell]) for cell in reason)
+        for literal in nogood:
+            self.nogoods.setdefault(literal, []).append(nogood)
+        self.stats['nogoods'] += 1
+
+    def violated(self, literal):
+        '''
+        Finds a learned nogood that holds after the given assignment.
+
+        Parameters
+        ----------
+        literal : tuple
+            The (cell, value) pair assigned last.
+
+        Returns
+        -------
+        set or None
+            The cells of the nogood, or None if no nogood holds.
+        '''
+        for nogood in self.nogoods.get(literal, ()):
+            if all(self.assign.get(cell) == value for cell, value in nogood):
+                return {cell for cell, _ in nogood}
+        return None
+
+    def csphelper(self, literal):
+        '''
+        Propagates the constraints for the current assignment and
+        branches on the first unassigned cell the lasers reach.
+
+        Parameters
+        ----------
+        literal : tuple or None
+            The (cell, value) pair assigned last.
+
+        Returns
+        -------
+        set or None
+            The cells whose values explain why this branch has no solution,
+            or None if a solution was found.
+        '''
+        if self.terminate:
+            return None
+        self.stats['nodes'] += 1
+
+        if literal is not None:
+            reason = self.violated(literal)
+            if reason is not None:
+                return reason
+
+        # Block counts: every remaining block needs an unassigned cell
+        left = sum(self.blockAvailable)
+        if left > len(self.freeCells) - len(self.assign):
+            return {cell for cell, value in self.assign.items() if value == 'o'}
+
+        self.stats['checks'] += 1
+        path, _, frontier = self.expand(False)
+        if all(target in path for target in self.targets):
+            # expand(False) stops lasers at unassigned cells, so the paths
+            # found so far run only through assigned cells and no block
+            # placed on the rest can change them: any completion works
+            self.ans = copy.deepcopy(self.grid)
+            spare = [cell for cell in self.freeCells if cell not in self.assign]
+            for type in range(self.blockType):
+                for _ in range(self.blockAvailable[type]):
+                    i, j = spare.pop(0)
+                    self.ans[i][j] = BLOCK_LETTERS[type]
+            self.terminate = True
+            return None
+
+        # Target coverage: every target must stay reachable
+        reach, states, _ = self.expand(True)
+        if not all(target in reach for target in self.targets):
+            reason = self.explain(states)
+            self.learn(reason)
+            return reason
+
+        cell = min(frontier)
+        values = []
+        blocked = set()
+        for type in range(self.blockType):
+            charType = BLOCK_LETTERS[type]
+            if self.blockAvailable[type] > 0:
+                values.append((charType, type))
+            else:
+                blocked.add(charType)
+        values.append(('o', None))
+        if len(values) == 1:
+            # No blocks are left, so the cell is forced to stay empty
+            self.stats['forced_empty'] += 1
+
+        conflict = {c for c, value in self.assign.items() if value in blocked}
+        for value, type in values:
+            self.assign[cell] = value
+            self.grid[cell[0]][cell[1]] = value
+            if type is not None:
+                self.blockAvailable[type] -= 1
+            reason = self.csphelper((cell, value))
+            if type is not None:
+                self.blockAvailable[type] += 1
+            self.grid[cell[0]][cell[1]] = 'o'
+            del self.assign[cell]
+            if self.terminate:
+                return None
+            if cell not in reason:
+                self.stats['backjumps'] += 1
+                return reason
+            conflict |= reason - {cell}
+
+        self.learn(conflict)
+        return conflict
+
+
+def cross_check(file_paths):
+    '''
+    Solves each puzzle with both the constraint solver and the brute-force
+    solvehelper, and checks that they agree.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        Paths to '.bff' files.
+
+    Returns
+    -------
+    list of str
+        The files where the two solvers disagree or the constraint
+        solver's answer is not valid.
+    '''
+    failed = []
+    for file_path in file_paths:
+        grid, blockAvailable, lasers, targets = read_bff_file(file_path)
+        brute = Solution(copy.deepcopy(grid), list(blockAvailable), lasers, targets, file_path)
+        brute.search()
+        csp = CSPSolution(copy.deepcopy(grid), list(blockAvailable), lasers, targets, file_path)
+        csp.search()
+
+        if (brute.ans is None) != (csp.ans is None):
+            failed.append(file_path)
+            continue
+        if csp.ans is None:
+            continue
+
+        # Check the block counts and the laser paths of the answer
+        check = Solution(csp.ans, list(blockAvailable), lasers, targets, file_path)
+        for i in range(len(grid)):
+            for j in range(len(grid[0])):
+                if csp.ans[i][j] != grid[i][j]:
+                    check.blockAvailable[BLOCK_LETTERS.index(csp.ans[i][j])] -= 1
+        if any(check.blockAvailable) or not check.checkResult():
+            failed.append(file_path)
+    return failed
+
+
+# Test
+if __name__ == '__main__':
+    base_dir = os.path.abspath('bff_files')
+    file_paths = [os.path.join(base_dir, name) for name in sorted(os.listdir(base_dir))
+                  if name.endswith('.bff')]
+    failed = cross_check(file_paths)
+    if not failed:
+        print("Constraint solver cross-check passed.")
+    else:
+        print(f"Constraint solver disagrees on: {failed}")
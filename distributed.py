@@ -0,0 +1,555 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from collections import deque
+from final_version import parse_bff, read_bff_file, Solution, BLOCK_LETTERS
+from engines import ParallelSolution
+
+# Seconds a worker may hold a unit without a heartbeat before it is handed out again
+LEASE = 30.0
+
+# Seconds an idle worker waits before asking for work again
+RETRY_DELAY = 0.5
+
+
+async def send(writer, message):
+    '''
+    Sends one JSON message as a line.
+
+    Parameters
+    ----------
+    writer : asyncio.StreamWriter
+    message : dict
+
+    Returns
+    -------
+    None.
+    '''
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+
+async def receive(reader):
+    '''
+    Reads one JSON message.
+
+    Parameters
+    ----------
+    reader : asyncio.StreamReader
+
+    Returns
+    -------
+    dict or None
+        The message, or None when the connection is closed.
+    '''
+    line = await reader.readline()
+    return json.loads(line) if line else None
+
+
+def tree_units(file_path, workers):
+    '''
+    Splits the solvehelper search of one puzzle into work units.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the '.bff' file.
+    workers : int
+        Number of workers expected to share the search.
+
+    Returns
+    -------
+    list of dict
+        The units, in solvehelper's search order.
+    '''
+    with open(file_path) as file:
+        text = file.read()
+    grid, blockAvailable, lasers, targets = parse_bff(text, file_path)
+    splitter = ParallelSolution(grid, blockAvailable, lasers, targets, file_path, workers)
+    return [{'kind': 'tree', 'name': file_path, 'puzzle': text, 'prefix': prefix, 'start': start}
+            for prefix, start in splitter.workUnits()]
+
+
+def file_units(file_paths):
+    '''
+    Makes one work unit per puzzle file.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        Paths to '.bff' files.
+
+    Returns
+    -------
+    list of dict
+    '''
+    units = []
+    for file_path in file_paths:
+        with open(file_path) as file:
+            units.append({'kind': 'file', 'name': file_path, 'puzzle': file.read()})
+    return units
+
+
+def run_unit(unit, sol_holder):
+    '''
+    Solves one work unit. The Solution is put in sol_holder first, so
+    that a stop message can set its terminate flag while it runs.
+
+    Parameters
+    ----------
+    unit : dict
+        The work unit.
+    sol_holder : list
+        Receives the Solution being run.
+
+    Returns
+    -------
+    dict
+        The solution grid (or None) and the search statistics.
+    '''
+    puzzle = parse_bff(unit['puzzle'], unit['name'])
+    if unit['kind'] == 'file':
+        from planner import plan_solution
+        sol = plan_solution(puzzle, unit['name'], processes=1)
+        sol_holder.append(sol)
+        sol.search()
+    else:
+        sol = Solution(*puzzle, unit['name'])
+        sol_holder.append(sol)
+        for (i, j), type in unit['prefix']:
+            sol.grid[i][j] = BLOCK_LETTERS[type]
+            sol.blockAvailable[type] -= 1
+        sol.solvehelper(*unit['start'])
+    return {'ans': sol.ans, 'stats': sol.stats}
+
+
+class Coordinator:
+    '''
+    Hands work units to workers over TCP.
+
+    Each unit handed out is leased to its worker. Workers send heartbeats
+    while they run a unit; a unit whose lease runs out, or whose worker
+    disconnects, goes back to the queue. With stop_on_solution set, the
+    first solution ends the run and every worker is told to stop.
+    '''
+
+    def __init__(self, units, stop_on_solution=False, lease=LEASE):
+        '''
+        Sets up the coordinator.
+
+        Parameters
+        ----------
+        units : list of dict
+            The work units, from tree_units or file_units.
+        stop_on_solution : bool, optional
+            Stop all workers once any unit finds a solution.
+        lease : float, optional
+            Seconds a unit is leased for without a heartbeat.
+
+        Returns
+        -------
+        None.
+        '''
+        self.units = units
+        self.stop_on_solution = stop_on_solution
+        self.lease = lease
+        self.pending = deque(range(len(units)))
+        self.leases = {}
+        self.results = {}
+        self.writers = set()
+        self.handlers = set()
+        self.stats = {'handed_out': 0, 'requeued': 0, 'workers': 0}
+
+    def finished(self):
+        '''
+        Checks whether the run is over.
+
+        Returns
+        -------
+        bool
+        '''
+        if self.stop_on_solution and any(r['ans'] is not None for r in self.results.values()):
+            return True
+        return len(self.results) == len(self.units)
+
+    def requeue(self, unit_id):
+        '''
+        Puts a leased unit back at the front of the queue.
+
+        Parameters
+        ----------
+        unit_id : int
+
+        Returns
+        -------
+        None.
+        '''
+        if self.leases.pop(unit_id, None) is not None and unit_id not in self.results:
+            self.pending.appendleft(unit_id)
+            self.stats['requeued'] += 1
+
+    async def start(self, host='127.0.0.1', port=0):
+        '''
+        Starts listening for workers.
+
+        Parameters
+        ----------
+        host : str, optional
+        port : int, optional
+            0 picks a free port.
+
+        Returns
+        -------
+        tuple
+            The host and port workers should connect to.
+        '''
+        self.done = asyncio.Event()
+        if self.finished():
+            self.done.set()
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.reaper = asyncio.create_task(self.reap())
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def wait(self):
+        '''
+        Waits for the run to finish, tells the workers to stop and closes the server.
+
+        Returns
+        -------
+        dict
+            The result of each unit that was finished, by unit index.
+        '''
+        await self.done.wait()
+        self.reaper.cancel()
+        for writer in list(self.writers):
+            try:
+                await send(writer, {'type': 'stop'})
+            except ConnectionError:
+                pass
+        self.server.close()
+        await self.server.wait_closed()
+
+        # Give workers time to hang up before dropping their connections
+        if self.handlers:
+            await asyncio.wait(self.handlers, timeout=self.lease)
+        for writer in list(self.writers):
+            writer.transport.abort()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        return self.results
+
+    async def reap(self):
+        '''
+        Hands out again the units whose lease ran out.
+
+        Returns
+        -------
+        None.
+        '''
+        while True:
+            await asyncio.sleep(self.lease / 4)
+            now = time.monotonic()
+            for unit_id, (_, deadline) in list(self.leases.items()):
+                if deadline < now:
+                    self.requeue(unit_id)
+
+    async def handle(self, reader, writer):
+        '''
+        Talks to one worker until it disconnects.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+        writer : asyncio.StreamWriter
+
+        Returns
+        -------
+        None.
+        '''
+        self.writers.add(writer)
+        self.handlers.add(asyncio.current_task())
+        self.stats['workers'] += 1
+        try:
+            while True:
+                message = await receive(reader)
+                if message is None:
+                    break
+                kind = message['type']
+                if kind == 'request':
+                    if self.done.is_set():
+                        await send(writer, {'type': 'stop'})
+                    elif self.pending:
+                        unit_id = self.pending.popleft()
+                        self.leases[unit_id] = (writer, time.monotonic() + self.lease)
+                        self.stats['handed_out'] += 1
+                        await send(writer, {'type': 'unit', 'id': unit_id, 'lease': self.lease,
+                                            'unit': self.units[unit_id]})
+                    else:
+                        await send(writer, {'type': 'wait', 'delay': RETRY_DELAY})
+                elif kind == 'heartbeat':
+                    if message['id'] in self.leases:
+                        self.leases[message['id']] = (writer, time.monotonic() + self.lease)
+                elif kind == 'result':
+                    unit_id = message['id']
+                    self.leases.pop(unit_id, None)
+                    if unit_id not in self.results and not message.get('stopped'):
+                        self.results[unit_id] = message['result']
+                    if self.finished() and not self.done.is_set():
+                        self.done.set()
+                        for other in list(self.writers):
+                            if other is not writer:
+                                await send(other, {'type': 'stop'})
+        except (ConnectionError, json.JSONDecodeError):
+            pass
+        finally:
+            self.handlers.discard(asyncio.current_task())
+            self.writers.discard(writer)
+            for unit_id, (owner, _) in list(self.leases.items()):
+                if owner is writer:
+                    self.requeue(unit_id)
+            writer.close()
+
+
+async def run_worker(host, port):
+    '''
+    Connects to a coordinator and runs work units until told to stop.
+
+    Parameters
+    ----------
+    host : str
+    port : int
+
+    Returns
+    -------
+    int
+        Number of units finished.
+    '''
+    loop = asyncio.get_running_loop()
+    reader, writer = await asyncio.open_connection(host, port)
+    inbox = asyncio.Queue()
+    stopped = asyncio.Event()
+    current = []
+
+    async def listen():
+        while True:
+            message = await receive(reader)
+            if message is None or message['type'] == 'stop':
+                stopped.set()
+                for sol in current:
+                    sol.terminate = True
+                return
+            await inbox.put(message)
+
+    listener = asyncio.create_task(listen())
+    stop = asyncio.create_task(stopped.wait())
+    finished = 0
+    try:
+        while not stopped.is_set():
+            await send(writer, {'type': 'request'})
+            get = asyncio.create_task(inbox.get())
+            await asyncio.wait([get, stop], return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                break
+            message = get.result()
+            if message['type'] == 'wait':
+                await asyncio.sleep(message['delay'])
+                continue
+
+            current.clear()
+            job = loop.run_in_executor(None, run_unit, message['unit'], current)
+            while True:
+                done, _ = await asyncio.wait([job], timeout=message['lease'] / 3)
+                if done:
+                    break
+                await send(writer, {'type': 'heartbeat', 'id': message['id']})
+            result = job.result()
+            await send(writer, {'type': 'result', 'id': message['id'], 'result': result,
+                                'stopped': stopped.is_set()})
+            finished += 1
+    except ConnectionError:
+        pass
+    finally:
+        listener.cancel()
+        stop.cancel()
+        writer.close()
+    return finished
+
+
+def write_answers(units, results):
+    '''
+    Writes each puzzle's answer the way Solution.printAns does.
+
+    Parameters
+    ----------
+    units : list of dict
+        The work units.
+    results : dict
+        The result of each finished unit, by unit index.
+
+    Returns
+    -------
+    dict
+        The answer grid (or None) for each puzzle file.
+    '''
+    answers = {}
+    for unit_id, unit in enumerate(units):
+        result = results.get(unit_id)
+        if result is not None and result['ans'] is not None:
+            answers[unit['name']] = result['ans']
+        else:
+            answers.setdefault(unit['name'], None)
+    for name, ans in answers.items():
+        sol = Solution(*read_bff_file(name), name)
+        sol.ans = ans
+        sol.printAns()
+    return answers
+
+
+def spawn_local_workers(count, host, port):
+    '''
+    Starts worker processes on this machine.
+
+    Parameters
+    ----------
+    count : int
+    host : str
+    port : int
+
+    Returns
+    -------
+    list of subprocess.Popen
+    '''
+    script = os.path.abspath(__file__)
+    return [subprocess.Popen([sys.executable, script, 'worker', '--host', str(host), '--port', str(port)])
+            for _ in range(count)]
+
+
+async def coordinate(file_paths, host, port, workers, local):
+    if len(file_paths) == 1:
+        units = tree_units(file_paths[0], workers)
+        coordinator = Coordinator(units, stop_on_solution=True)
+    else:
+        units = file_units(file_paths)
+        coordinator = Coordinator(units)
+    host, port = await coordinator.start(host, port)
+    print(f"Coordinator on {host}:{port} with {len(units)} units")
+    processes = spawn_local_workers(local, host, port)
+    results = await coordinator.wait()
+    for process in processes:
+        process.wait()
+    answers = write_answers(units, results)
+    for name, ans in answers.items():
+        print(f"File: {os.path.basename(name)}, Solved: {ans is not None}")
+    print(coordinator.stats)
+
+
+async def self_check(file_paths, split_path, local=2, lease=1.0, timeout=60.0):
+    '''
+    Runs a coordinator with local worker processes on the given puzzles,
+    alongside a worker that takes a unit and then goes silent.
+
+    First each file is a unit: the silent worker's unit must be handed
+    out again once its lease runs out, and every file must be solved.
+    Then one puzzle's search is split and stopped at the first solution: the silent worker must be sent the stop message and the
+    worker processes must exit.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        Paths to solvable '.bff' files.
+    split_path : str
+        A solvable '.bff' file whose search splits into several units.
+    local : int, optional
+        Number of worker processes to start.
+    lease : float, optional
+        Seconds a unit is leased for, kept short so the check is quick.
+    timeout : float, optional
+        Seconds each run may take before the check gives up on it.
+
+    Returns
+    -------
+    list of str
+        What went wrong, if anything.
+    '''
+    from verifier import Verifier
+
+    failures = []
+    for units, stop_on_solution in ((file_units(file_paths), False),
+                                    (tree_units(split_path, local), True)):
+        coordinator = Coordinator(units, stop_on_solution, lease)
+        host, port = await coordinator.start()
+        reader, writer = await asyncio.open_connection(host, port)
+        await send(writer, {'type': 'request'})
+        silent = await receive(reader)
+        processes = spawn_local_workers(local, host, port)
+        try:
+            results = await asyncio.wait_for(coordinator.wait(), timeout)
+        except asyncio.TimeoutError:
+            failures.append(f"a run did not finish in {timeout} seconds: {coordinator.stats}")
+            coordinator.reaper.cancel()
+            coordinator.server.close()
+            for process in processes:
+                process.kill()
+                process.wait()
+            writer.close()
+            continue
+        stop = await receive(reader)
+        writer.close()
+        for process in processes:
+            try:
+                process.wait(timeout=10 * lease)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                failures.append(f"worker {process.pid} did not stop")
+
+        answers = [result['ans'] for result in results.values() if result['ans'] is not None]
+        for unit_id, result in results.items():
+            if result['ans'] is not None:
+                verifier = Verifier(*parse_bff(units[unit_id]['puzzle'], units[unit_id]['name']))
+                if not verifier.verify(result['ans'])['valid']:
+                    failures.append(f"{units[unit_id]['name']}: invalid answer")
+        if stop_on_solution:
+            if not answers:
+                failures.append(f"{split_path}: split search found no solution")
+            if stop is None or stop['type'] != 'stop':
+                failures.append(f"silent worker got {stop} instead of a stop message")
+        else:
+            if len(answers) != len(units):
+                failures.append(f"solved {len(answers)} of {len(units)} files")
+            if silent['id'] not in results or coordinator.stats['requeued'] < 1:
+                failures.append(f"the silent worker's unit was not handed out again: {coordinator.stats}")
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distributed Lazor solving over TCP.')
+    sub = parser.add_subparsers(dest='role', required=True)
+    coord = sub.add_parser('coordinator', help='split the work and collect the answers')
+    coord.add_argument('files', nargs='+', help='one .bff file to split, or several to share out')
+    coord.add_argument('--host', default='127.0.0.1')
+    coord.add_argument('--port', type=int, default=9000)
+    coord.add_argument('--workers', type=int, default=4, help='expected number of workers')
+    coord.add_argument('--local', type=int, default=0, help='start this many workers here')
+    work = sub.add_parser('worker', help='run work units for a coordinator')
+    work.add_argument('--host', default='127.0.0.1')
+    work.add_argument('--port', type=int, default=9000)
+    sub.add_parser('check', help='run a coordinator and local workers on the bundled files')
+    args = parser.parse_args()
+
+    if args.role == 'coordinator':
+        asyncio.run(coordinate(args.files, args.host, args.port, args.workers, args.local))
+    elif args.role == 'worker':
+        asyncio.run(run_worker(args.host, args.port))
+    else:
+        base_dir = os.path.abspath('bff_files')
+        file_paths = [os.path.join(base_dir, name) for name in sorted(os.listdir(base_dir))
+                      if name.endswith('.bff')]
+        failed = asyncio.run(self_check(file_paths, os.path.join(base_dir, 'mad_7.bff')))
+        if not failed:
+            print("Distributed self-check passed.")
+        else:
+            print(f"Distributed self-check failed: {failed}")
@@ -0,0 +1,544 @@
+import os
+import copy
+import queue
+import itertools
+import threading
+import multiprocessing
+import tracing
+from final_version import Solution, BLOCK_LETTERS, PRUNING_RULES
+from csp_solver import CSPSolution
+from scheduler import StealingSolution
+
+# Directions of a laser, indexed as in the vector engine
+DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+# Number of boards evaluated together by the vector engine
+BATCH_SIZE = 4096
+
+# Work units handed to each process by the parallel engine
+UNITS_PER_WORKER = 8
+
+# Complete engines raced by the portfolio engine, in order of preference
+PORTFOLIO = ('csp', 'beam')
+
+# Seconds between checks on the portfolio's processes
+POLL_INTERVAL = 0.1
+
+
+def block_orders(counts):
+    '''
+    Yields every distinct ordering of the available blocks.
+
+    Parameters
+    ----------
+    counts : list of int
+        Numbers of each block type.
+
+    Returns
+    -------
+    generator of tuple
+        Block type indices, one per placed block.
+    '''
+    total = sum(counts)
+    if total == 0:
+        yield ()
+        return
+    for type in range(len(counts)):
+        if counts[type] == 0:
+            continue
+        counts[type] -= 1
+        for rest in block_orders(counts):
+            yield (type,) + rest
+        counts[type] += 1
+
+
+class BeamSolution(Solution):
+    '''
+    Only places blocks on cells that a laser currently passes through.
+    A block on any other cell cannot change the laser paths, so once every
+    target is hit the leftover blocks go on cells the lasers do not touch.
+    '''
+
+    def search(self):
+        '''
+        Runs the beam-driven search.
+
+        Returns
+        -------
+        None.
+        '''
+        self.empty = set()
+        self.beamhelper()
+
+    def beamhelper(self):
+        '''
+        Traces the current grid and branches on the first free cell
+        the lasers pass through: either a block goes there or the cell
+        stays empty for the rest of this branch.
+
+        Returns
+        -------
+        None.
+        '''
+        if self.terminate:
+            return
+        self.stats['nodes'] += 1
+        self.stats['checks'] += 1
+        crossed = set()
+        path = self.tracePaths(crossed)
+        hit = all(target in path for target in self.targets)
+        left = sum(self.blockAvailable)
+
+        if hit:
+            spare = [(i, j) for i, j in self.freeCells
+                     if self.grid[i][j] == 'o' and (i, j) not in crossed]
+            if len(spare) >= left:
+                self.ans = copy.deepcopy(self.grid)
+                for type in range(self.blockType):
+                    for _ in range(self.blockAvailable[type]):
+                        i, j = spare.pop(0)
+                        self.ans[i][j] = BLOCK_LETTERS[type]
+                self.terminate = True
+                return
+        elif left == 0:
+            return
+
+        options = sorted(cell for cell in crossed
+                         if self.grid[cell[0]][cell[1]] == 'o' and cell not in self.empty)
+        if not options:
+            return
+        i, j = options[0]
+
+        for type in range(self.blockType):
+            if self.blockAvailable[type] == 0:
+                continue
+            self.grid[i][j] = BLOCK_LETTERS[type]
+            self.blockAvailable[type] -= 1
+            self.beamhelper()
+            self.blockAvailable[type] += 1
+            self.grid[i][j] = 'o'
+
+        self.empty.add((i, j))
+        self.beamhelper()
+        self.empty.remove((i, j))
+
+
+class VectorSolution(Solution):
+    '''
+    Enumerates complete placements like solvehelper, but traces them in
+    batches with NumPy, following every laser of every board at once.
+    '''
+
+    def search(self):
+        '''
+        Runs the batched search.
+
+        Returns
+        -------
+        None.
+        '''
+        import numpy as np
+
+        cells = self.freeCells
+        placed = sum(self.blockAvailable)
+        if placed > len(cells):
+            return
+        H = len(self.grid[0])
+        codes = {BLOCK_LETTERS[type]: type + 1 for type in range(self.blockType)}
+        base = np.array([codes.get(cell, 0) for col in self.grid for cell in col], dtype=np.int8)
+        flat = np.array([i * H + j for i, j in cells], dtype=np.intp)
+        orders = list(block_orders(list(self.blockAvailable)))
+        orders = np.array(orders, dtype=np.int8).reshape(len(orders), placed) + 1
+
+        per_batch = max(1, BATCH_SIZE // len(orders))
+        combos = itertools.combinations(range(len(cells)), placed)
+        while not self.terminate:
+            chunk = np.array(list(itertools.islice(combos, per_batch)), dtype=np.intp)
+            if len(chunk) == 0:
+                break
+            chunk = chunk.reshape(len(chunk), placed)
+            boards = np.tile(base, (len(chunk) * len(orders), 1))
+            rows = np.arange(len(boards))[:, None]
+            boards[rows, flat[np.repeat(chunk, len(orders), axis=0)]] = np.tile(orders, (len(chunk), 1))
+
+            with tracing.span('traceBoards', boards=len(boards)):
+                hits = self.traceBoards(np, boards)
+            self.stats['nodes'] += len(boards)
+            self.stats['checks'] += len(boards)
+            found = np.flatnonzero(hits)
+            if len(found):
+                board = boards[found[0]]
+                self.ans = copy.deepcopy(self.grid)
+                for (i, j) in cells:
+                    code = board[i * H + j]
+                    if code:
+                        self.ans[i][j] = BLOCK_LETTERS[code - 1]
+                self.terminate = True
+
+    def traceBoards(self, np, boards):
+        '''
+        Traces the lasers on a batch of boards.
+        Each laser state is (board, x, y, direction); all states move one
+        step per loop, and a state seen before is dropped.
+
+        Parameters
+        ----------
+        np : module
+            The NumPy module.
+        boards : numpy.ndarray
+            Cell codes, one flattened board per row.
+
+        Returns
+        -------
+        numpy.ndarray
+            True for each board where every target is hit.
+        '''
+        B = len(boards)
+        W, H = len(self.grid), len(self.grid[0])
+        M, N = 2 * W, 2 * H
+        # Lattice padded by one point on each side
+        PX, PY = M + 3, N + 3
+        passes = np.array([True, False, False, True])
+        reflects = np.array([False, True, False, True])
+        dxs = np.array([d[0] for d in DIRECTIONS])
+        dys = np.array([d[1] for d in DIRECTIONS])
+
+        path = np.zeros(B * PX * PY, dtype=bool)
+        visited = np.zeros(B * PX * PY * 4, dtype=bool)
+
+        b = np.repeat(np.arange(B), len(self.laserQueue))
+        x = np.tile([laser[0] for laser in self.laserQueue], B)
+        y = np.tile([laser[1] for laser in self.laserQueue], B)
+        k = np.tile([DIRECTIONS.index((laser[2], laser[3])) for laser in self.laserQueue], B)
+
+        while len(b):
+            state = ((b * PX + x + 1) * PY + y + 1) * 4 + k
+            state, first = np.unique(state, return_index=True)
+            keep = ~visited[state]
+            visited[state[keep]] = True
+            first = first[keep]
+            b, x, y, k = b[first], x[first], y[first], k[first]
+            path[(b * PX + x + 1) * PY + y + 1] = True
+
+            dx, dy = dxs[k], dys[k]
+            nx, ny = x + dx, y + dy
+            inside = (nx >= 0) & (nx <= M) & (ny >= 0) & (ny <= N)
+            b, x, y, k, dx, dy, nx, ny = (a[inside] for a in (b, x, y, k, dx, dy, nx, ny))
+            cell = boards[b, ((2 * x + dx) // 4) * H + (2 * y + dy) // 4]
+
+            go = passes[cell]
+            rx = np.where(nx % 2 == 0, dx, -dx)
+            ry = np.where(ny % 2 == 0, dy, -dy)
+            turn = reflects[cell]
+            rk = (rx < 0) * 2 + (ry < 0)
+
+            b = np.concatenate((b[go], b[turn]))
+            x = np.concatenate((nx[go], (x + rx)[turn]))
+            y = np.concatenate((ny[go], (y + ry)[turn]))
+            k = np.concatenate((k[go], rk[turn]))
+
+        path = path.reshape(B, PX * PY)
+        hits = np.ones(B, dtype=bool)
+        for tx, ty in self.targets:
+            if not (-1 <= tx <= M + 1 and -1 <= ty <= N + 1):
+                return np.zeros(B, dtype=bool)
+            hits &= path[:, (tx + 1) * PY + ty + 1]
+        return hits
+
+
+# Puzzle shared by the parallel engine's worker processes
+_shared = None
+
+
+def _init_worker(grid, blockAvailable, lasers, targets, rules):
+    global _shared
+    _shared = (grid, blockAvailable, lasers, targets, rules)
+
+
+def _solve_unit(unit):
+    '''
+    Runs solvehelper on one work unit of the parallel engine.
+
+    Parameters
+    ----------
+    unit : tuple
+        The blocks placed on the first free cells, and the cell to resume from.
+
+    Returns
+    -------
+    tuple
+        The solution grid (or None) and the search statistics.
+    '''
+    grid, blockAvailable, lasers, targets, rules = _shared
+    sol = Solution(copy.deepcopy(grid), list(blockAvailable), lasers, targets, '')
+    sol.rules = rules
+    prefix, start = unit
+    for (i, j), type in prefix:
+        sol.grid[i][j] = BLOCK_LETTERS[type]
+        sol.blockAvailable[type] -= 1
+    sol.solvehelper(*start)
+    return sol.ans, sol.stats
+
+
+class ParallelSolution(Solution):
+    '''
+    Splits the solvehelper search tree by the blocks on the first few
+    free cells and searches the parts in a process pool.
+    Parts are collected in the order solvehelper would visit them,
+    so the answer is the same as a single-process search.
+    '''
+
+    def __init__(self, grid, blockAvailable, lasers, targets, name, processes=None):
+        super().__init__(grid, blockAvailable, lasers, targets, name)
+        self.processes = processes or os.cpu_count() or 1
+
+    def workUnits(self):
+        '''
+        Splits the search into work units. The choices that blockChoices
+        prunes on the way to each unit are kept in self.splitPruned, so
+        that search() counts them only for the units it runs.
+
+        Returns
+        -------
+        list of tuple
+            The blocks placed on the first free cells, and the cell to resume from.
+        '''
+        cells = self.freeCells
+        depth = 0
+        prefixes = [[]]
+        pruned = self.stats['pruned']
+        self.splitPruned = [dict.fromkeys(PRUNING_RULES, 0)]
+        while depth < len(cells) and len(prefixes) < UNITS_PER_WORKER * self.processes:
+            depth += 1
+            prefixes = []
+            self.splitPruned = []
+            self.stats['pruned'] = dict.fromkeys(PRUNING_RULES, 0)
+            for prefix in self.prefixes(cells[:depth], []):
+                prefixes.append(prefix)
+                self.splitPruned.append(self.stats['pruned'])
+                self.stats['pruned'] = dict.fromkeys(PRUNING_RULES, 0)
+            # Choices pruned after the last unit come after all of them
+            for rule, count in self.stats['pruned'].items():
+                self.splitPruned[-1][rule] += count
+        self.stats['pruned'] = pruned
+        start = self.nextMove(*cells[depth - 1]) if depth else (0, 0)
+        return [(prefix, start) for prefix in prefixes]
+
+    def prefixes(self, cells, prefix):
+        '''
+        Yields the block choices for the given cells in solvehelper's order:
+        the cell left empty first, then each block type that blockChoices
+        allows. The choices are placed on the grid while they are tried.
+
+        Parameters
+        ----------
+        cells : list of tuple
+            The cells still to decide.
+        prefix : list of tuple
+            The (cell, block type) choices made so far.
+
+        Returns
+        -------
+        generator of list
+        '''
+        if not cells:
+            yield list(prefix)
+            return
+        yield from self.prefixes(cells[1:], prefix)
+        i, j = cells[0]
+        for type in self.blockChoices(i, j):
+            self.grid[i][j] = BLOCK_LETTERS[type]
+            self.blockAvailable[type] -= 1
+            prefix.append((cells[0], type))
+            yield from self.prefixes(cells[1:], prefix)
+            prefix.pop()
+            self.blockAvailable[type] += 1
+            self.grid[i][j] = 'o'
+
+    def search(self):
+        '''
+        Runs the work units in a process pool and keeps the first solution
+        in search order.
+
+        Returns
+        -------
+        None.
+        '''
+        with tracing.span('workUnits'):
+            units = self.workUnits()
+        self.stats['units'] = len(units)
+        args = (self.grid, self.blockAvailable, self.laserQueue, self.targets, self.rules)
+        with multiprocessing.Pool(self.processes, _init_worker, args) as pool:
+            for (ans, stats), split in zip(pool.imap(_solve_unit, units), self.splitPruned):
+                self.stats['nodes'] += stats['nodes']
+                self.stats['checks'] += stats['checks']
+                for rule, count in stats['pruned'].items():
+                    self.stats['pruned'][rule] += count + split[rule]
+                if ans is not None:
+                    self.ans = ans
+                    self.terminate = True
+                    break
+
+
+def _run_portfolio(engine, puzzle, results):
+    sol = ENGINES[engine](*puzzle, '')
+    sol.search()
+    results.put((engine, sol.ans, sol.stats))
+
+
+class PortfolioSolution(Solution):
+    '''
+    Races complete engines and keeps the first to finish. Each engine
+    searches the whole space, so the first answer, or the first proof that
+    there is none, settles the puzzle; the others are stopped. The
+    constraint and beam searches are each very slow on some puzzles that
+    the other solves at once, so racing them bounds the solve time by the
+    faster of the two, or about twice that when they share a core.
+
+    With more than one process the engines run in processes of their own;
+    otherwise, as in batch workers, they run in threads of this process.
+    '''
+
+    def __init__(self, grid, blockAvailable, lasers, targets, name, processes=None):
+        super().__init__(grid, blockAvailable, lasers, targets, name)
+        self.processes = processes or os.cpu_count() or 1
+
+    def search(self):
+        '''
+        Runs the race.
+
+        Raises
+        ------
+        RuntimeError
+            If every engine failed without a result.
+
+        Returns
+        -------
+        None.
+        '''
+        classic = classic_blocks(self.grid, self.blockAvailable)
+        engines = [engine for engine in PORTFOLIO if classic or engine not in CLASSIC_ENGINES]
+        if self.processes > 1:
+            engine, ans, stats = self.raceProcesses(engines)
+        else:
+            engine, ans, stats = self.raceThreads(engines)
+        self.ans = ans
+        self.stats['nodes'] += stats['nodes']
+        self.stats['checks'] += stats['checks']
+        self.stats['winner'] = engine
+
+    def raceProcesses(self, engines):
+        '''
+        Races the engines in processes of their own.
+
+        Parameters
+        ----------
+        engines : list of str
+            Keys of ENGINES.
+
+        Returns
+        -------
+        tuple
+            The winning engine, its answer and its statistics.
+        '''
+        ctx = multiprocessing.get_context()
+        results = ctx.Queue()
+        puzzle = (self.grid, self.blockAvailable, self.laserQueue, self.targets)
+        workers = [ctx.Process(target=_run_portfolio, args=(engine, puzzle, results), daemon=True)
+                   for engine in engines]
+        for worker in workers:
+            worker.start()
+        try:
+            while True:
+                try:
+                    return results.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers) and results.empty():
+                        raise RuntimeError(f"portfolio engines {engines} all died without a result")
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            for worker in workers:
+                worker.join()
+
+    def raceThreads(self, engines):
+        '''
+        Races the engines in threads, each on its own copy of the grid.
+
+        Parameters
+        ----------
+        engines : list of str
+            Keys of ENGINES.
+
+        Returns
+        -------
+        tuple
+            The winning engine, its answer and its statistics.
+        '''
+        done = queue.Queue()
+
+        def run(engine, sol):
+            try:
+                sol.search()
+                done.put((engine, sol, None))
+            except Exception as exc:
+                done.put((engine, sol, exc))
+
+        sols = {engine: ENGINES[engine](copy.deepcopy(self.grid), list(self.blockAvailable),
+                                        self.laserQueue, self.targets, '')
+                for engine in engines}
+        threads = [threading.Thread(target=run, args=item, daemon=True) for item in sols.items()]
+        for thread in threads:
+            thread.start()
+        errors = []
+        try:
+            while len(errors) < len(threads):
+                engine, sol, exc = done.get()
+                if exc is None:
+                    return engine, sol.ans, sol.stats
+                errors.append(f"{engine}: {exc!r}")
+            raise RuntimeError(f"portfolio engines all failed: {errors}")
+        finally:
+            for sol in sols.values():
+                sol.terminate = True
+            for thread in threads:
+                thread.join()
+
+
+# Solver engines by name, all used through the Solution interface
+ENGINES = {
+    'enumerate': Solution,
+    'beam': BeamSolution,
+    'vector': VectorSolution,
+    'parallel': ParallelSolution,
+    'csp': CSPSolution,
+    'stealing': StealingSolution,
+    'portfolio': PortfolioSolution,
+}
+
+# Engines that take a number of processes as their last argument
+PROCESS_ENGINES = {'parallel', 'stealing', 'portfolio'}
+
+# Engines with the reflect, opaque and refract rules built in, which can not
+# solve puzzles that use other registered block types
+CLASSIC_ENGINES = {'vector', 'csp'}
+
+
+def classic_blocks(grid, blockAvailable):
+    '''
+    Checks whether a puzzle only uses the reflect, opaque and refract blocks.
+
+    Parameters
+    ----------
+    grid : list of list
+        The game grid layout.
+    blockAvailable : list of int
+        Numbers of each block type.
+
+    Returns
+    -------
+    bool
+    '''
+    classic = {'o', 'x'} | set(BLOCK_LETTERS[:3])
+    return len(blockAvailable) <= 3 and all(cell in classic for col in grid for cell in col)
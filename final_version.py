@@ -1,215 +1,954 @@
 import os
+import mmap
 import time
 import copy
-import numpy as np
-from PIL import Image
+import array
+import hashlib
+import tracing
 
-def read_bff_file(file_path):
+
+class BffFormatError(ValueError):
     '''
-    Reads a '.bff' file to get grid, blocks, lasers, and target points.
-    Buld a grid to mark the different block and position.
-    Mark different types of blocks and calculate the number; 'A' as Reflect blocks; 'B' as Opaque blocks; 'C' as Refract blocks.
-    Mark laser position and its direction.
-    Mark the target points.
+    Raised when a '.bff' file is malformed.
+    '''
+
+
+def parse_bff(text, file_path='<string>'):
+    '''
+    Parses the content of a '.bff' file to get grid, blocks, lasers, and target points.
+    Lines starting with '#' are comments.
+    The grid is transposed so that it is indexed as grid[x][y].
 
     Parameters
     ----------
-    file_path: str
-        Path to '.bff' files.
+    text : str
+        Content of a '.bff' file.
+    file_path : str, optional
+        Name of the file, used in error messages.
+
+    Raises
+    ------
+    BffFormatError
+        If a line can not be read or a value is out of range.
 
     Returns
     -------
-    trans_grid : list of str
+    trans_grid : list of list
         Transposed grid showing each cell's content
     updated_blocks :  list of int
-        Numbers of each block type: A, B, C.
+        Numbers of each block type: A, B, C, then any other registered types in use.
     lasers : list of tuple
         Laser information for start position and direction.
     points : list of tuple
         Target points at (x, y) coordinates.
-
     '''
 
     # Initialize the data stracture
     grid = []
-    blocks = {'A': 0, 'B': 0, 'C': 0}
-    block_types = ['A', 'B', 'C']
+    blocks = dict.fromkeys(BLOCK_LETTERS, 0)
     lasers = []
     points = []
-    laser = 'L'
-    point = "P"
-    grid_start = 'GRID START'
-    grid_stop = 'GRID STOP'
-
-    # Read files
-    with open(file_path, 'r') as file:
-        for line in file:
-            line = line.strip() # Remove white sapce
-            if not line:
-                continue # Skip empty lines
-
-            # store lines in grid
-            if line == grid_start:
-                for line in file:
-                    line = line.strip()
-                    if line == grid_stop:
-                        break
-                    if line:
-                        grid.append(line)
+    in_grid = False
+    grid_done = False
+
+    def error(lineno, message):
+        return BffFormatError(f"{file_path}:{lineno}: {message}")
+
+    def numbers(lineno, line, count):
+        fields = line.split()
+        if len(fields) != count + 1:
+            raise error(lineno, f"expected {count} numbers after '{fields[0]}', got '{line}'")
+        try:
+            return [int(field) for field in fields[1:]]
+        except ValueError:
+            raise error(lineno, f"expected integers, got '{line}'") from None
+
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip() # Remove white sapce
+        if not line or line[0] == '#':
+            continue # Skip empty lines and comments
+
+        # store lines in grid
+        if in_grid:
+            if line == 'GRID STOP':
+                in_grid = False
+                grid_done = True
+                continue
+            row = line.split()
+            for cell in row:
+                if cell not in CELL_TYPES:
+                    raise error(lineno, f"unknown grid cell '{cell}'")
+            if grid and len(row) != len(grid[0]):
+                raise error(lineno, f"grid row has {len(row)} cells, expected {len(grid[0])}")
+            grid.append(row)
+
+        elif line == 'GRID START':
+            if grid_done:
+                raise error(lineno, "second grid")
+            in_grid = True
+
+        # store lines in blocks if it starts with a block letter, such as 'A', 'B', 'C'
+        elif line[0] in blocks:
+            count, = numbers(lineno, line, 1)
+            if line.split()[0] != line[0] or count < 0:
+                raise error(lineno, f"bad block line '{line}'")
+            blocks[line[0]] = count
+
+        # store lines in lasor if it starts with 'L'
+        elif line[0] == 'L':
+            x, y, vx, vy = numbers(lineno, line, 4)
+            if vx not in (-1, 1) or vy not in (-1, 1):
+                raise error(lineno, f"laser direction must be diagonal, got ({vx}, {vy})")
+            lasers.append((x, y, vx, vy, lineno))
+
+        # store lines in target points if it starts with "P"
+        elif line[0] == 'P':
+            x, y = numbers(lineno, line, 2)
+            points.append((x, y, lineno))
 
-            # store lines in blocks if it starts with 'A', 'B', 'C' 
-            elif line[0] in block_types:
-                current_block, count = line.split()
-                blocks[current_block] = int(count)
+        else:
+            raise error(lineno, f"unknown line '{line}'")
 
-            # store lines in lasor if it starts with 'L'
-            elif line[0] == laser:
-                _, x, y, vx, vy = line.split()
-                lasers.append((int(x), int(y), int(vx), int(vy)))
+    if in_grid:
+        raise error(lineno, "missing 'GRID STOP'")
+    if not grid:
+        raise BffFormatError(f"{file_path}: no grid")
 
-            # store lines in target points if it starts with "P"
-            elif line[0] == 'P':
-                _, x, y, = line.split()
-                points.append((int(x), int(y)))
+    # Positions count half blocks, so they must lie within twice the grid size
+    M, N = 2 * len(grid[0]), 2 * len(grid)
+    for x, y, *_, lineno in lasers + points:
+        if not (0 <= x <= M and 0 <= y <= N):
+            raise error(lineno, f"position ({x}, {y}) is outside the grid")
 
     # Update the data
-    # Convert grid indices (i, j) (row, column) to coordinates (x, y), 
+    # Convert grid indices (i, j) (row, column) to coordinates (x, y),
     # where (x = j) (horizontal) and (y = i) (vertical).
-    updated_grid = [row.split() for row in grid]
-    updated_blocks = [blocks[num] for num in ['A', 'B', 'C']]
-    trans_grid = np.transpose(updated_grid)
+    trans_grid = [list(col) for col in zip(*grid)]
+    # Puzzles with only the first three block types keep three counts
+    updated_blocks = [blocks[letter] for letter in BLOCK_LETTERS]
+    while len(updated_blocks) > 3 and updated_blocks[-1] == 0:
+        updated_blocks.pop()
+    lasers = [laser[:4] for laser in lasers]
+    points = [point[:2] for point in points]
 
     return trans_grid, updated_blocks, lasers, points
 
+
+def puzzle_key(puzzle):
+    '''
+    Hashes a parsed puzzle, so that files which differ only in comments
+    or spacing share a key.
+
+    Parameters
+    ----------
+    puzzle : tuple
+        The grid, block counts, lasers and targets from parse_bff.
+
+    Returns
+    -------
+    str
+        The hex digest.
+    '''
+    return hashlib.sha256(repr(puzzle).encode()).hexdigest()
+
+
+def read_bff_file(file_path):
+    '''
+    Reads a '.bff' file to get grid, blocks, lasers, and target points.
+    See parse_bff for the returned values.
+
+    Parameters
+    ----------
+    file_path: str
+        Path to '.bff' files.
+
+    Raises
+    ------
+    BffFormatError
+        If the file is malformed.
+
+    Returns
+    -------
+    tuple
+        The grid, block counts, lasers and target points.
+    '''
+    with tracing.span('read_bff_file', file=file_path), open(file_path, 'r') as file:
+        return parse_bff(file.read(), file_path)
+
+
+def read_bff_files(file_paths):
+    '''
+    Reads many '.bff' files, keeping going past malformed ones.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        Paths to '.bff' files.
+
+    Returns
+    -------
+    puzzles : dict
+        The parsed puzzle for each file that could be read.
+    errors : dict
+        The error for each file that could not be read.
+    '''
+    puzzles = {}
+    errors = {}
+    for file_path in file_paths:
+        try:
+            puzzles[file_path] = read_bff_file(file_path)
+        except (OSError, UnicodeDecodeError, BffFormatError) as exc:
+            errors[file_path] = exc
+    return puzzles, errors
+
+
+def write_atomic(file_path, text):
+    '''
+    Writes a file in one go through a temporary file, so readers and
+    killed writers never leave a partly written file behind.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the file to write.
+    text : str or bytes
+        The whole content of the file.
+
+    Returns
+    -------
+    None.
+    '''
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb' if isinstance(text, bytes) else 'w') as file:
+            file.write(text)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def solution_text(rows):
+    '''
+    Formats a solution grid as the content of a '_solution.txt' file.
+
+    Parameters
+    ----------
+    rows : list of list or None
+        The solution grid row by row, or None if there is no solution.
+
+    Returns
+    -------
+    str
+    '''
+    if rows is None:
+        return "No solution found.\n"
+    return ''.join(''.join(f"{cell} " for cell in row) + "\n" for row in rows)
+
+# Colors of the cells by content; registered blocks add theirs
+CELL_COLORS = {
+    'o': (235, 235, 235),
+    'x': (90, 90, 90),
+}
+
+
+# How blocks send on a laser: given its direction and the direction it would
+# have if reflected, the directions it leaves in
+
+
+def pass_laser(direction, reflected):
+    return [direction]
+
+
+def reflect_laser(direction, reflected):
+    return [reflected]
+
+
+def stop_laser(direction, reflected):
+    return []
+
+
+def refract_laser(direction, reflected):
+    return [direction, reflected]
+
+
+def one_way_laser(direction, reflected):
+    return [direction] if direction[0] > 0 else [reflected]
+
+
+def retro_laser(direction, reflected):
+    return [(-direction[0], -direction[1])]
+
+
 class Block:
-    def __init__(self, block_type, position):
+    def __init__(self, letter, block_type, interact, color=(128, 128, 128)):
         '''
-        Initializes a block object with a specified type and position.
+        Describes a type of block.
 
         Parameters
         ----------
+        letter : str
+            The letter of the block in '.bff' files.
         block_type : str
-            The type includes 'reflect', 'opaque', or 'refract'.
-        position : tuple
-            The (x, y) coordinates representing the position on the grid.
+            The name of the type, such as 'reflect', 'opaque', or 'refract'.
+        interact : function
+            Takes the direction of a laser crossing the block and the
+            direction it would have if reflected, and returns the list of
+            directions it leaves the block in.
+        color : tuple, optional
+            The RGB color of the block in images.
 
         Returns
         -------
         None
         '''
+        self.letter = letter
         self.block_type = block_type
-        self.position = position
-        
-        
-    def interact_with_laser(self, laser):
-            
+        self.interact = interact
+        self.color = color
+
+    def interact_with_laser(self, direction, reflected):
         '''
         Defines how the block interacts with a laser.
-        
+
         Parameters
         ----------
-        laser : laser type
-            The laser interacting with the block, which has a direction.
+        direction : tuple
+            The direction of the laser before reaching the block.
+        reflected : tuple
+            The direction of the laser if the block reflects it.
 
-        Raises
-        ------
-        ValueError
-            If the block type is not known.
+        Returns
+        -------
+        list of tuple
+            The directions the laser leaves the block in; empty if it stops.
+        '''
+        return self.interact(direction, reflected)
+
+    def __str__(self):
+        '''
+        Get the block's letter and type information.
 
         Returns
         -------
-        Tuple or None
-            A tuple showing the new laser direction after hitting the block
-            None if the laser stops at an opaque block.
+        str
+            A string contains info about block's letter and type.
 
         '''
-        
-        if self.block_type == 'reflect':
-            return self.reflect_laser(laser.direction)
-        
-        # Laser stops at an opaque block
-        elif self.block_type == 'opaque':
-            return None
-        
-        elif self.block_type == 'refract':
-            return self.refract_laser(laser.direction)
-        
-        # Value error if can not read the block type
-        else:
-            raise ValueError(f"Unknown block type: {self.block_type}")
+        return f"Block(letter={self.letter}, type={self.block_type})"
 
-    def reflect_laser(self, direction):
+
+# Every cell content by letter, and the letters of the blocks that can be placed,
+# in the order of the block counts
+CELL_TYPES = {'o': Block('o', 'empty', pass_laser), 'x': Block('x', 'fixed', pass_laser)}
+BLOCK_LETTERS = []
+
+
+def register_block(block):
+    '''
+    Adds a block type, so that puzzles can use its letter.
+
+    Parameters
+    ----------
+    block : Block
+
+    Raises
+    ------
+    ValueError
+        If the letter is not a single capital letter, is taken, or is 'L' or 'P'.
+
+    Returns
+    -------
+    None.
+    '''
+    if len(block.letter) != 1 or not block.letter.isupper() or block.letter in CELL_TYPES \
+            or block.letter in ('L', 'P'):
+        raise ValueError(f"can not register block letter '{block.letter}'")
+    CELL_TYPES[block.letter] = block
+    BLOCK_LETTERS.append(block.letter)
+    CELL_COLORS[block.letter] = block.color
+    _tables.clear()
+
+
+# Grid sizes and geometries whose tables each process keeps in memory
+GEOMETRY_CACHE_SIZE = 64
+
+# Layout version of the cache files; part of their keys, so files of an
+# older layout are never read
+CACHE_FORMAT = 1
+
+_tables = {}
+_jumps = {}
+_cache_directory = None
+
+register_block(Block('A', 'reflect', reflect_laser, (255, 215, 120)))
+register_block(Block('B', 'opaque', stop_laser, (20, 20, 20)))
+register_block(Block('C', 'refract', refract_laser, (150, 200, 255)))
+register_block(Block('D', 'one-way', one_way_laser, (255, 160, 200)))
+register_block(Block('E', 'retroreflect', retro_laser, (170, 120, 220)))
+
+
+class LaserTable:
+    '''
+    The laser moves on a grid of a given size, compiled to integer tables.
+
+    A laser state is a lattice point and a direction, numbered over the
+    lattice padded by one point on each side. For each state the table
+    holds the cell the laser crosses next, and for each cell content the
+    states it moves on to. Tracing is then a walk over lists, whatever the
+    block types.
+    '''
+
+    def __init__(self, width, height):
         '''
-        Changes the laser’s direction if it is reflected.
+        Compiles the tables.
 
         Parameters
         ----------
-        direction : tuple
-            The direction of the laser before hitting the block.
+        width, height : int
+            The grid size in cells.
 
         Returns
         -------
-        tuple
-            The direction after reflection.
+        None.
+        '''
+        M, N = 2 * width, 2 * height
+        self.width, self.height = width, height
+        self.PY = N + 3
+        size = (M + 3) * self.PY * 4
+        self.letters = list(CELL_TYPES)
+        self.codes = {letter: code for code, letter in enumerate(self.letters)}
+        self.point = [None] * size
+        # Cell crossed next, or -1 when the next point is off the grid
+        self.cell = [-1] * size
+        moves = {block: [()] * size for block in set(CELL_TYPES.values())}
+        for x in range(-1, M + 2):
+            for y in range(-1, N + 2):
+                for dx in (1, -1):
+                    for dy in (1, -1):
+                        s = self.state(x, y, dx, dy)
+                        self.point[s] = (x, y)
+                        nx, ny = x + dx, y + dy
+                        cx, cy = (2 * x + dx) // 4, (2 * y + dy) // 4
+                        if nx > M or ny > N or nx < 0 or ny < 0 or not (0 <= cx < width and 0 <= cy < height):
+                            continue
+                        self.cell[s] = cx * height + cy
+                        reflected = (dx if nx % 2 == 0 else -dx, dy if ny % 2 == 0 else -dy)
+                        for block, table in moves.items():
+                            table[s] = tuple(self.state(x + ox, y + oy, ox, oy)
+                                             for ox, oy in block.interact((dx, dy), reflected)
+                                             if -1 <= x + ox <= M + 1 and -1 <= y + oy <= N + 1)
+        self.moves = [moves[CELL_TYPES[letter]] for letter in self.letters]
+
+    def save(self, file_path):
+        '''
+        Writes the tables as 32-bit integers for load(): the size, then the
+        crossed cells, then for each cell content the number of moves of
+        each state and the moves in columns padded with -1.
 
+        Parameters
+        ----------
+        file_path : str
 
+        Returns
+        -------
+        None.
+        '''
+        slots = max(len(next) for table in self.moves for next in table)
+        data = array.array('i', [self.width, self.height, len(self.moves), slots])
+        data.extend(self.cell)
+        for table in self.moves:
+            data.extend(len(next) for next in table)
+            for k in range(slots):
+                data.extend(next[k] if k < len(next) else -1 for next in table)
+        write_atomic(file_path, data.tobytes())
+
+    @classmethod
+    def load(cls, file_path):
         '''
-        return (-direction[0], -direction[1])
+        Reads tables written by save(), decoding them into lists of this
+        process.
+
+        Parameters
+        ----------
+        file_path : str
 
-    def refract_laser(self, direction):
+        Returns
+        -------
+        LaserTable
+        '''
+        data = map_ints(file_path)
+        width, height, codes, slots = data[:4]
+        M, N = 2 * width, 2 * height
+        table = cls.__new__(cls)
+        table.width, table.height = width, height
+        table.PY = N + 3
+        size = (M + 3) * table.PY * 4
+        table.letters = list(CELL_TYPES)
+        table.codes = {letter: code for code, letter in enumerate(table.letters)}
+        table.point = [(x, y) for x in range(-1, M + 2) for y in range(-1, N + 2) for _ in range(4)]
+        table.cell = data[4:4 + size].tolist()
+        table.moves = []
+        offset = 4 + size
+        for _ in range(codes):
+            counts = data[offset:offset + size].tolist()
+            columns = [data[offset + (k + 1) * size:offset + (k + 2) * size].tolist() for k in range(slots)]
+            table.moves.append([row[:n] for row, n in zip(zip(*columns), counts)])
+            offset += (slots + 1) * size
+        return table
+
+    def state(self, x, y, dx, dy):
+        '''
+        Numbers a laser state.
+
+        Returns
+        -------
+        int
+        '''
+        return (((x + 1) * self.PY + y + 1) * 2 + (dx < 0)) * 2 + (dy < 0)
+
+    def board(self, grid):
         '''
-        Allows the laser passing through if it is refracted.
+        Codes the cells of a grid, flattened as x * height + y.
 
         Parameters
         ----------
-        direction : tuple
-            The direction of the laser.
+        grid : list of list
+            The grid, indexed as grid[x][y].
 
         Returns
         -------
-        list
-            The same direction of the laser.
+        list of int
+        '''
+        codes = self.codes
+        return [codes[cell] for col in grid for cell in col]
 
+    def trace(self, board, lasers):
         '''
-        return [direction]
-        
-    def __str__(self):
+        Traces lasers on a coded board. A state is visited once, so beams
+        caught in a loop between blocks do not run forever.
+
+        Parameters
+        ----------
+        board : list of int
+            The board, from board().
+        lasers : list of tuple
+            Laser start positions and directions.
+
+        Returns
+        -------
+        set
+            The states the lasers pass through.
+        '''
+        cell, moves = self.cell, self.moves
+        seen = set()
+        stack = [self.state(*laser) for laser in lasers]
+        while stack:
+            s = stack.pop()
+            if s in seen:
+                continue
+            seen.add(s)
+            c = cell[s]
+            if c >= 0:
+                stack.extend(moves[board[c]][s])
+        return seen
+
+    def segments(self, board, lasers):
         '''
-        Get the block's type and position information.
+        Traces lasers on a coded board and lists each move between two
+        lattice points, for drawing.
+
+        Parameters
+        ----------
+        board : list of int
+            The board, from board().
+        lasers : list of tuple
+            Laser start positions and directions.
 
         Returns
         -------
-        str
-            A string contains info about block's type and position.
+        list of tuple
+            The ((x, y), (x, y)) start and end of each move.
+        '''
+        point, cell, moves = self.point, self.cell, self.moves
+        segments = []
+        for s in self.trace(board, lasers):
+            if cell[s] >= 0:
+                segments.extend((point[s], point[t]) for t in moves[board[cell[s]]][s])
+        return segments
+
+
+class SegmentGraph:
+    '''
+    Jumps of the lasers of one puzzle between the states where the beam
+    meets a free cell, a fixed block or the edge of the grid.
+
+    Across 'x' cells a laser moves on without any choice, so for each state
+    the graph stores the first state where it reaches one of those, and the
+    targets covered on the way as a bit mask. Tracing then costs one step
+    per decision point instead of one per half cell, and stops as soon as
+    every target is covered.
+    '''
+
+    def __init__(self, table, grid, lasers, targets):
+        '''
+        Looks up the jumps of the puzzle's geometry and marks the targets
+        on them. Only the straight runs of states that end on a target
+        get a mask, walking back from the target.
+
+        Parameters
+        ----------
+        table : LaserTable
+            The compiled moves for the grid size.
+        grid : list of list
+            The puzzle grid, indexed as grid[x][y]. Only its 'x' cells are
+            jumped over, so blocks later placed on 'o' cells do not change it.
+        lasers : list of tuple
+            Laser start positions and directions.
+        targets : list of tuple
+            Target points.
 
+        Returns
+        -------
+        None.
         '''
-        return f"Block(type={self.block_type}, position={self.position})"
+        self.table = table
+        self.starts = [table.state(*laser) for laser in lasers]
+        self.full = (1 << len(targets)) - 1
+        self.end = end = segment_jumps(table, grid)
+        self.covered = covered = [0] * len(end)
+        M, N = 2 * table.width, 2 * table.height
+        for n, (x, y) in enumerate(targets):
+            if not (-1 <= x <= M + 1 and -1 <= y <= N + 1):
+                continue
+            for dx in (1, -1):
+                for dy in (1, -1):
+                    px, py = x, y
+                    s = table.state(px, py, dx, dy)
+                    while True:
+                        covered[s] |= 1 << n
+                        px, py = px - dx, py - dy
+                        if not (-1 <= px <= M + 1 and -1 <= py <= N + 1):
+                            break
+                        s = table.state(px, py, dx, dy)
+                        if end[s] == s:
+                            break
+
+    def covers(self, board):
+        '''
+        Traces the lasers on a coded board by jumps.
+
+        Parameters
+        ----------
+        board : list of int
+            The board, from LaserTable.board().
+
+        Returns
+        -------
+        int
+            The bit mask of the targets covered; equal to self.full
+            when all of them are.
+        '''
+        end, covered, full = self.end, self.covered, self.full
+        cell, moves = self.table.cell, self.table.moves
+        hit = 0
+        seen = set()
+        stack = list(self.starts)
+        while stack:
+            s = stack.pop()
+            if s in seen:
+                continue
+            seen.add(s)
+            hit |= covered[s]
+            if hit == full:
+                break
+            e = end[s]
+            c = cell[e]
+            if c >= 0:
+                stack.extend(moves[board[c]][e])
+        return hit
+
+
+def laser_table(width, height):
+    '''
+    Gets the compiled LaserTable for a grid size, building it once.
+
+    Parameters
+    ----------
+    width, height : int
+        The grid size in cells.
+
+    Returns
+    -------
+    LaserTable
+    '''
+    table = _tables.get((width, height))
+    if table is None:
+        file_path = None
+        if _cache_directory:
+            file_path = os.path.join(_cache_directory, f"table_{width}x{height}_{registry_key()}.bin")
+        if file_path and os.path.exists(file_path):
+            table = LaserTable.load(file_path)
+        else:
+            table = LaserTable(width, height)
+            if file_path:
+                table.save(file_path)
+    _remember(_tables, (width, height), table)
+    return table
+
+
+def segment_jumps(table, grid):
+    '''
+    Gets, for each laser state, the first state where the beam meets a
+    free cell, a fixed block or the edge of the grid, running straight
+    across 'x' cells. The jumps only depend on the geometry of a puzzle,
+    so puzzles that share it share them, and they are built once.
+
+    Parameters
+    ----------
+    table : LaserTable
+        The compiled moves for the grid size.
+    grid : list of list
+        The puzzle grid, indexed as grid[x][y].
+
+    Returns
+    -------
+    list of int
+        The state each state jumps to; a state where the beam meets
+        something jumps to itself.
+    '''
+    key = geometry_key(grid)
+    end = _jumps.get(key)
+    if end is None:
+        file_path = None
+        if _cache_directory:
+            file_path = os.path.join(_cache_directory, f"jumps_{key}_{registry_key()}.bin")
+        if file_path and os.path.exists(file_path):
+            end = map_ints(file_path).tolist()
+        else:
+            opens = [cell == 'x' for col in grid for cell in col]
+            passTo = table.moves[table.codes['x']]
+            end = [-1] * len(table.cell)
+            for s in range(len(end)):
+                chain = []
+                t = s
+                while end[t] < 0:
+                    c = table.cell[t]
+                    if c < 0 or not opens[c]:
+                        end[t] = t
+                        break
+                    chain.append(t)
+                    t = passTo[t][0]
+                for u in chain:
+                    end[u] = end[t]
+            if file_path:
+                write_atomic(file_path, array.array('i', end).tobytes())
+    _remember(_jumps, key, end)
+    return end
+
+
+def _remember(cache, key, value):
+    # Keeps the GEOMETRY_CACHE_SIZE most recently used entries
+    cache.pop(key, None)
+    if len(cache) >= GEOMETRY_CACHE_SIZE:
+        del cache[next(iter(cache))]
+    cache[key] = value
+
+
+def geometry_key(grid):
+    '''
+    Hashes the geometry of a puzzle: its grid shape and 'x' cells. Puzzles
+    that differ only in lasers, targets, blocks or where blocks are placed
+    share a key.
+
+    Parameters
+    ----------
+    grid : list of list
+        The puzzle grid, indexed as grid[x][y].
+
+    Returns
+    -------
+    str
+        The hex digest.
+    '''
+    shape = '\n'.join(''.join('x' if cell == 'x' else 'o' for cell in col) for col in grid)
+    return hashlib.sha256(shape.encode()).hexdigest()
+
+
+def registry_key():
+    '''
+    Hashes the registered cell types and the code of their behaviours,
+    which the compiled tables depend on, with the CACHE_FORMAT. Editing a
+    behaviour, or registering a different one under a letter, changes it.
+
+    Returns
+    -------
+    str
+        A short hex digest.
+    '''
+    digest = hashlib.sha256(f"format {CACHE_FORMAT}".encode())
+    for letter, block in CELL_TYPES.items():
+        digest.update(letter.encode())
+        _hash_code(digest, block.interact.__code__)
+    return digest.hexdigest()[:16]
+
+
+def _hash_code(digest, code):
+    # The bytecode, constants and names of a function, with those of any
+    # functions defined inside it
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _hash_code(digest, const)
+        else:
+            digest.update(repr(const).encode())
+
+
+def map_ints(file_path):
+    '''
+    Maps a file of 32-bit integers read-only into memory, for decoding.
+
+    Parameters
+    ----------
+    file_path : str
+
+    Returns
+    -------
+    memoryview
+        The integers; the mapping stays open while the view is used.
+    '''
+    with open(file_path, 'rb') as file:
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)).cast('i')
+
+
+def use_cache_directory(directory):
+    '''
+    Keeps compiled tables as files in a directory, a build cache shared by
+    worker processes and later runs: each process loads the files it finds
+    there instead of building the tables, and writes the ones it builds.
+    Loaded tables are decoded into lists of each process, which the
+    tracing loops index much faster than the file data, so the files save
+    the build time, not memory. Without a directory tables are only cached
+    in the memory of each process.
+
+    Parameters
+    ----------
+    directory : str or None
+        The cache directory, created if needed; None turns the files off.
+
+    Returns
+    -------
+    None.
+    '''
+    global _cache_directory
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _cache_directory = directory
+
+
+LINE_COLOR = (160, 160, 160)
+BEAM_COLOR = (255, 0, 0)
+TARGET_COLOR = (0, 180, 0)
+
 
 class GridImage:
-    def __init__(self, grid, lasers, points, file_path):
+    def __init__(self, grid, lasers, points, file_path, cell_size=40):
         '''
         Sets up the GridImage.
         
         Parameters
         ----------
-        grid : list of str
-            A 2D list shows the grid layout
+        grid : list of str or list of list
+            The grid layout indexed as grid[x][y], either as lists of cells
+            or as space separated strings. A solved grid draws the placed blocks.
         lasers : list of tuple
             List of laser start points
         points : list of tuple
             List of target points
         file_path : str
             The path of saving image
+        cell_size : int, optional
+            Width of a cell in pixels.
 
         Returns
         -------
         None.
 
         '''
-        self.grid = grid
+        self.grid = [row.split() if isinstance(row, str) else list(row) for row in grid]
         self.lasers = lasers
         self.points = points
         self.file_path = file_path
+        self.cell_size = cell_size
+
+    def render(self):
+        '''
+        Draws the grid, the traced laser paths and the target points
+        into one NumPy frame.
+
+        Returns
+        -------
+        numpy.ndarray
+            The image as a (height, width, 3) array of uint8.
+        '''
+        import numpy as np
+
+        cs = self.cell_size
+        W, H = len(self.grid), len(self.grid[0])
+        palette = np.array(list(CELL_COLORS.values()), dtype=np.uint8)
+        index = {cell: n for n, cell in enumerate(CELL_COLORS)}
+        codes = np.array([[index[cell] for cell in col] for col in self.grid]).T
+
+        # Fill whole cells, then draw the cell borders
+        frame = palette[np.repeat(np.repeat(codes, cs, axis=0), cs, axis=1)]
+        frame[::cs, :] = LINE_COLOR
+        frame[:, ::cs] = LINE_COLOR
+
+        # Lattice points are half a cell apart
+        half = cs / 2
+        table = laser_table(W, H)
+        segments = table.segments(table.board(self.grid), self.lasers)
+        segments = np.array(segments, dtype=float).reshape(-1, 2, 2)
+        if len(segments):
+            t = np.linspace(0, 1, cs)[None, :, None]
+            dots = (segments[:, :1] + (segments[:, 1:] - segments[:, :1]) * t).reshape(-1, 2) * half
+            self.paint(np, frame, dots, 1, BEAM_COLOR)
+
+        starts = np.array([laser[:2] for laser in self.lasers], dtype=float).reshape(-1, 2) * half
+        self.paint(np, frame, starts, max(2, cs // 8), BEAM_COLOR)
+        points = np.array(self.points, dtype=float).reshape(-1, 2) * half
+        self.paint(np, frame, points, max(2, cs // 6), TARGET_COLOR)
+        return frame
+
+    def paint(self, np, frame, centers, radius, color):
+        '''
+        Paints a filled disk around each center.
+
+        Parameters
+        ----------
+        np : module
+            The NumPy module.
+        frame : numpy.ndarray
+            The image to paint on.
+        centers : numpy.ndarray
+            The (x, y) pixel centers.
+        radius : int
+            Radius of the disks in pixels.
+        color : tuple
+            The RGB color.
+
+        Returns
+        -------
+        None.
+        '''
+        dx, dy = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+        disk = dx * dx + dy * dy <= radius * radius
+        xs = (np.rint(centers[:, 0])[:, None] + dx[disk]).astype(int).ravel()
+        ys = (np.rint(centers[:, 1])[:, None] + dy[disk]).astype(int).ravel()
+        inside = (xs >= 0) & (xs < frame.shape[1]) & (ys >= 0) & (ys < frame.shape[0])
+        frame[ys[inside], xs[inside]] = color
 
     def build_image(self):
         '''
@@ -220,32 +959,92 @@ class GridImage:
         None.
 
         '''
-        
-        # Creat the image
-        img = Image.new(mode="RGB", size=(100, 100))
-        
-        # Draw the grid and color the cells, black as 'x' , white as 'o'
-        x = 0
-        for i in self.grid:
-            y = 0
-            string = i.split(' ')
-            for j in string:
-                color = (0, 0, 0) if j == 'x' else (255, 255, 255)
-                img.putpixel((10 * x, 10 * y), color)
-                y += 1
-            x += 1
-            
-        # Draw the laser and color it as red
-        for laser in self.lasers:
-            x, y = laser[:2]
-            img.putpixel((10 * x, 10 * y), (255, 0, 0))
-            
-        # Draw the target points and color it as green
-        for x, y in self.points:
-            img.putpixel((10 * x, 10 * y), (0, 255, 0))
-            
-        # Save the updated image
-        img.save(self.file_path + '.png')
+        from PIL import Image
+
+        Image.fromarray(self.render()).save(self.file_path + '.png')
+
+
+def solve_and_render(file_path, render=True):
+    '''
+    Solves one puzzle in this process, writing its _solution.txt and, if
+    asked, an image of the solution as <name>_solution.png. An unsolved
+    puzzle is drawn as it was given.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the '.bff' file.
+    render : bool, optional
+        Whether to save the image.
+
+    Returns
+    -------
+    Solution
+        The solved puzzle.
+    '''
+    from planner import plan_solution
+
+    grid, blockAvailable, lasers, targets = read_bff_file(file_path)
+    puzzle = ([list(col) for col in grid], blockAvailable, lasers, targets)
+    sol = plan_solution(puzzle, file_path, processes=1)
+    sol.solve()
+    if render:
+        output_path = os.path.splitext(file_path)[0] + '_solution'
+        GridImage(sol.ans if sol.ans is not None else grid, lasers, targets, output_path).build_image()
+    return sol
+
+
+def _render_puzzle(file_path):
+    solve_and_render(file_path)
+    return os.path.splitext(file_path)[0] + '_solution.png'
+
+
+def render_corpus(file_paths, processes=None):
+    '''
+    Solves and renders many puzzles in a pool of worker processes.
+    Each image is saved next to its '.bff' file as <name>_solution.png.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        Paths to '.bff' files.
+    processes : int, optional
+        Number of worker processes; defaults to the CPU count.
+
+    Returns
+    -------
+    list of str
+        The paths of the saved images.
+    '''
+    import multiprocessing
+
+    with multiprocessing.Pool(processes) as pool:
+        return list(pool.imap_unordered(_render_puzzle, file_paths))
+
+
+# Dominance rules solvehelper uses to skip placements that can not
+# change the answer; each can be switched off in Solution.rules
+PRUNING_RULES = {'opaque': True, 'idle': True}
+
+
+def free_cells(grid):
+    '''
+    Lists the cells where a block can be placed, in the order that
+    Solution.solvehelper visits them.
+
+    Parameters
+    ----------
+    grid : list of list
+        The game grid layout.
+
+    Returns
+    -------
+    list of tuple
+        The (i, j) positions of the 'o' cells.
+    '''
+    return [(i, j) for i in range(len(grid)) for j in range(len(grid[0]))
+            if grid[i][j] == 'o']
+
 
 class Solution:
     def __init__(self, grid, blockAvailable, lasers, targets, name):
@@ -283,18 +1082,56 @@ class Solution:
         self.terminate = False
         self.grid = grid
         self.ans = None
+        self.table = laser_table(len(grid), len(grid[0]))
+        self.segments = None
 
-    def solve(self):
+        # Dominance rules for solvehelper, the block types that only stop
+        # lasers, and the free cells no laser can ever cross
+        self.rules = dict(PRUNING_RULES)
+        self.opaque = {type for type in range(self.blockType)
+                       if CELL_TYPES[BLOCK_LETTERS[type]].interact is stop_laser}
+        self.freeCells = free_cells(grid)
+        self.idle = self.idleCells()
+
+        # Search statistics, filled in while solving.
+        self.stats = {'nodes': 0, 'checks': 0, 'pruned': dict.fromkeys(PRUNING_RULES, 0)}
+
+    def solve(self, sink=None):
         '''
         Begins the block placement and outputs the solution if found.
 
+        Parameters
+        ----------
+        sink : object, optional
+            A result sink from batch.py that takes the record() of the
+            solve instead of printAns.
+
+        Returns
+        -------
+        None.
+
+        '''
+        t0 = time.time()
+        with tracing.span('search', puzzle=self.name, engine=self.stats.get('engine')):
+            self.search()
+        self.stats['search_time'] = time.time() - t0
+        with tracing.span('write', puzzle=self.name):
+            if sink is None:
+                self.printAns()
+            else:
+                sink.write(self.record())
+
+    def search(self):
+        '''
+        Runs the search for a block placement and stores it in self.ans.
+        Other solver engines override this method.
+
         Returns
         -------
         None.
 
         '''
         self.solvehelper(0, 0)
-        self.printAns()
 
     def nextMove(self, i, j):
         '''
@@ -326,6 +1163,12 @@ class Solution:
         Get the next cell position and skip the cell that cannot have a block placed.
         Save the original cell then try every available type in the current cell.
 
+        Two dominance rules, each switched by self.rules, skip placements:
+        'opaque' leaves opaque blocks to placeOpaque at the end of the branch,
+        and 'idle' fills the cells no laser can cross in one canonical way,
+        in order and with block types that never decrease. The number of
+        placements each rule skips is counted in self.stats['pruned'].
+
         Parameters
         ----------
         i : int
@@ -339,9 +1182,13 @@ class Solution:
         '''
         if self.terminate:
             return
+        self.stats['nodes'] += 1
         if i >= len(self.grid):
-            if sum(self.blockAvailable) == 0 and self.checkResult():
-                self.ans = copy.deepcopy(self.grid)
+            if sum(self.blockAvailable) == 0:
+                if self.checkResult():
+                    self.ans = copy.deepcopy(self.grid)
+            elif self.opaqueLeft():
+                self.placeOpaque()
             return
 
         nextI, nextJ = self.nextMove(i, j)
@@ -350,16 +1197,153 @@ class Solution:
             return
 
         initialType = self.grid[i][j]
-        for type in range(self.blockType):
-            charType = chr(ord('A') + type)
-            if self.blockAvailable[type] == 0:
-                continue
+        for type in self.blockChoices(i, j):
+            charType = BLOCK_LETTERS[type]
             self.grid[i][j] = charType
             self.blockAvailable[type] -= 1
             self.solvehelper(nextI, nextJ)
             self.blockAvailable[type] += 1
             self.grid[i][j] = initialType
 
+    def blockChoices(self, i, j):
+        '''
+        Lists the block types to try on a free cell, in order, leaving out
+        the ones the dominance rules in self.rules skip.
+
+        Parameters
+        ----------
+        i : int
+            Current row position.
+        j : int
+            Current column position.
+
+        Returns
+        -------
+        list of int
+            Block type indices.
+        '''
+        floor = 0
+        if self.rules['idle'] and (i, j) in self.idle:
+            # Blocks on idle cells change nothing: they fill those cells
+            # in order, with types that never decrease
+            before = self.idle[(i, j)]
+            if before is not None:
+                value = self.grid[before[0]][before[1]]
+                floor = self.blockType if value == 'o' else BLOCK_LETTERS.index(value)
+
+        pruned = self.stats['pruned']
+        choices = []
+        for type in range(self.blockType):
+            if self.blockAvailable[type] == 0:
+                continue
+            if self.rules['opaque'] and type in self.opaque:
+                pruned['opaque'] += 1
+            elif type < floor:
+                pruned['idle'] += 1
+            else:
+                choices.append(type)
+        return choices
+
+    def opaqueLeft(self):
+        '''
+        Checks whether the blocks still available are all opaque ones left
+        for placeOpaque by the 'opaque' rule.
+
+        Returns
+        -------
+        bool
+        '''
+        return self.rules['opaque'] and sum(self.blockAvailable) > 0 and \
+            all(self.blockAvailable[type] == 0 or type in self.opaque for type in range(self.blockType))
+
+    def idleCells(self):
+        '''
+        Finds the free cells that no laser can cross, whatever blocks are
+        placed. The lasers are traced with every free cell doing anything
+        that an empty cell or an available block could do.
+
+        Returns
+        -------
+        dict
+            Each idle cell, in solvehelper's order, mapped to the idle cell
+            before it, or None for the first one.
+        '''
+        table = self.table
+        H = len(self.grid[0])
+        board = table.board(self.grid)
+        free = {i * H + j for i, j in self.freeCells}
+        anything = [table.codes['o']] + [table.codes[BLOCK_LETTERS[type]]
+                                         for type in range(self.blockType) if self.blockAvailable[type] > 0]
+        crossed = set()
+        seen = set()
+        stack = [table.state(*laser) for laser in self.laserQueue]
+        while stack:
+            s = stack.pop()
+            if s in seen:
+                continue
+            seen.add(s)
+            c = table.cell[s]
+            if c < 0:
+                continue
+            crossed.add(c)
+            for code in (anything if c in free else (board[c],)):
+                stack.extend(table.moves[code][s])
+
+        idle = {}
+        before = None
+        for i, j in self.freeCells:
+            if i * H + j not in crossed:
+                idle[(i, j)] = before
+                before = (i, j)
+        return idle
+
+    def placeOpaque(self):
+        '''
+        Places the opaque blocks left at the end of a branch, for the
+        'opaque' rule.
+
+        An opaque block only stops lasers, so it can not bring a target
+        into reach: if the targets are not all hit without it, no placement
+        helps. On a cell no laser crosses it changes nothing, so when there
+        are enough free cells off the lasers they are used; otherwise each
+        crossed free cell is tried in turn.
+
+        Returns
+        -------
+        None.
+        '''
+        if self.terminate:
+            return
+        self.stats['checks'] += 1
+        crossed = set()
+        path = self.tracePaths(crossed)
+        if any(target not in path for target in self.targets):
+            return
+
+        left = [type for type in sorted(self.opaque) for _ in range(self.blockAvailable[type])]
+        free = [(i, j) for i, j in self.freeCells if self.grid[i][j] == 'o']
+        off = [cell for cell in free if cell not in crossed]
+        if len(off) >= len(left):
+            for (i, j), type in zip(off, left):
+                self.grid[i][j] = BLOCK_LETTERS[type]
+            self.ans = copy.deepcopy(self.grid)
+            self.terminate = True
+            for i, j in off[:len(left)]:
+                self.grid[i][j] = 'o'
+            return
+
+        type = left[0]
+        for i, j in free:
+            if (i, j) not in crossed:
+                continue
+            self.grid[i][j] = BLOCK_LETTERS[type]
+            self.blockAvailable[type] -= 1
+            self.placeOpaque()
+            self.blockAvailable[type] += 1
+            self.grid[i][j] = 'o'
+            if self.terminate:
+                return
+
     def nextPassThrough(self, laser):
         '''
         Finds the next cell that the laser will pass through.
@@ -377,65 +1361,88 @@ class Solution:
         nextI, nextJ = laser[0] + laser[2], laser[1] + laser[3]
         return int((nextI + laser[0]) / 2 // 2), int((nextJ + laser[1]) / 2 // 2)
 
-    def moveLaser(self, laser, tempQueue, path):
+    def tracePaths(self, crossed=None):
         '''
-        Moves the laser within the grid and tracks its path.
-        
-        Firsly, check the laser's next position, and stop the loop 
-        if the laser goes out of grid bounds.
-        Then calculate the position in different cases.
-        After that update the laser to move to its next position.
+        Traces every laser on the current grid with the compiled LaserTable,
+        so block types only change the tables, not this loop.
 
         Parameters
         ----------
-        laser : tuple
-            The current position and direction of laser
-        tempQueue : list
-            A list that tracks the laser's movement.
-        path : set
-            The set of positions that the laser has passed through
+        crossed : set, optional
+            If given, collects the (x, y) cells the lasers pass through.
 
         Returns
         -------
-        None.
+        set
+            The positions that the lasers have passed through.
         '''
-        while True:
-            path.add((laser[0], laser[1]))
-            nextI, nextJ = laser[0] + laser[2], laser[1] + laser[3]
-            if nextI > self.M or nextJ > self.N or nextI < 0 or nextJ < 0:
-                break
-            x, y = self.nextPassThrough(laser)
-            passThroughType = self.grid[x][y]
-            if passThroughType == 'A' or passThroughType == 'C':
-                refI = int(nextI if (nextI % 2 == 0) else (2 * laser[0] - nextI))
-                refJ = int(nextJ if (nextJ % 2 == 0) else (2 * laser[1] - nextJ))
-                newLaser = (refI, refJ, refI - laser[0], refJ - laser[1])
-                tempQueue.append(newLaser)
-            if passThroughType == 'B' or passThroughType == 'A':
-                break
-            laser = (nextI, nextJ, laser[2], laser[3])
+        table = self.table
+        seen = table.trace(table.board(self.grid), self.laserQueue)
+        if crossed is not None:
+            H = table.height
+            crossed.update(divmod(table.cell[s], H) for s in seen if table.cell[s] >= 0)
+        point = table.point
+        return {point[s] for s in seen}
+
+    def traceSegments(self):
+        '''
+        Traces every laser on the current grid and lists each move
+        between two lattice points, for drawing.
+
+        Returns
+        -------
+        list of tuple
+            The ((x, y), (x, y)) start and end of each move.
+        '''
+        return self.table.segments(self.table.board(self.grid), self.laserQueue)
 
     def checkResult(self):
         '''
         Checks if all target points are hit by the laser paths.
         
-        Firstly, process every laser path;
-        then check if each target is in the path.
+        The lasers are traced by jumps over the puzzle's SegmentGraph,
+        which stops as soon as every target is hit.
 
         Returns
         -------
         True if all targets are hit; False otherwise.
         '''
-        path = set()
-        tempQueue = copy.deepcopy(self.laserQueue)
-        while len(tempQueue) > 0:
-            laser = tempQueue.pop()
-            self.moveLaser(laser, tempQueue, path)
-        for target in self.targets:
-            if target not in path:
-                return False
-        self.terminate = True
-        return True
+        self.stats['checks'] += 1
+        start = time.perf_counter() if tracing.enabled else None
+        if self.segments is None:
+            self.segments = SegmentGraph(self.table, self.grid, self.laserQueue, self.targets)
+        hit = self.segments.covers(self.table.board(self.grid)) == self.segments.full
+        if start is not None:
+            tracing.check_done(start)
+        if hit:
+            self.terminate = True
+        return hit
+
+    def ansRows(self):
+        '''
+        Gets the solution grid row by row, as it appears in the '.bff' file.
+
+        Returns
+        -------
+        list of list or None
+            The rows of the solution grid, or None if no solution is found.
+        '''
+        if self.ans is None:
+            return None
+        return [[self.ans[i][j] for i in range(len(self.ans))] for j in range(len(self.ans[0]))]
+
+    def record(self):
+        '''
+        Gets the result of the solve as a JSON-ready record.
+
+        Returns
+        -------
+        dict
+            The puzzle name, whether it was solved, the solution grid
+            row by row and the search statistics.
+        '''
+        return {'name': self.name, 'solved': self.ans is not None,
+                'grid': self.ansRows(), 'stats': self.stats}
 
     def printAns(self):
         '''
@@ -450,19 +1457,14 @@ class Solution:
         filename = base_name + '_solution.txt'
         if self.ans is None:
             print("No solution found.")
-            with open(filename, 'w') as file:
-                file.write("No solution found.\n")
-        else:
-            with open(filename, 'w') as file:
-                for j in range(len(self.ans[0])):
-                    for i in range(len(self.ans)):
-                        file.write(f"{self.ans[i][j]} ")
-                    file.write("\n")
+        write_atomic(filename, solution_text(self.ansRows()))
                     
 base_dir = os.path.abspath('bff_files')
 file_names = ["yarn_5.bff", "tiny_5.bff", "numbered_6.bff", "mad_1.bff", "mad_7.bff", "mad_4.bff", "dark_1.bff"]
 
 if __name__ == "__main__":
+    from planner import solve_puzzle
+
     # Store runtime for each file
     times = []
     
@@ -472,16 +1474,14 @@ if __name__ == "__main__":
         # Start timer
         t0 = time.time()
         
-        # Read data and get the solution
-        grid, blockAvailable, lasers, targets = read_bff_file(file_path)
-        sol = Solution(grid, blockAvailable, lasers, targets, file_path)
-        sol.solve()
+        # Read data, pick a solver engine and get the solution
+        sol = solve_puzzle(file_path)
         
         # End timer
         t1 = time.time()
         
         times.append(t1 - t0)
-        print(f"File: {name}, Time: {t1 - t0} seconds")
+        print(f"File: {name}, Engine: {sol.stats['engine']}, Time: {t1 - t0} seconds")
                 
 # Other Test
 if __name__ == '__main__':
@@ -489,43 +1489,37 @@ if __name__ == '__main__':
     grid, block_available, lasers, points = read_bff_file(file_path)
     print(f"Successfully read {file_path}")
     
-    # Test Block Initialization
-    block = Block('reflect', (1, 1))
-    if block.block_type == 'reflect' and block.position == (1, 1):
+    # Test the registered blocks
+    block = CELL_TYPES['A']
+    if block.block_type == 'reflect' and block.letter == 'A':
         print("Initialization test passed.")
 
     # Test Reflect Block Interaction
-    laser = type('Laser', (object,), {'direction': (1, 1)})
-    reflected_direction = block.interact_with_laser(laser)
-    if reflected_direction == (-1, -1):
+    direction, reflected = (1, 1), (-1, 1)
+    if block.interact_with_laser(direction, reflected) == [reflected]:
         print("Reflect interaction test passed.")
 
     # Test Opaque Block Interaction
-    opaque_block = Block('opaque', (2, 2))
-    laser_stopped = opaque_block.interact_with_laser(laser)
-    if laser_stopped is None:
+    if CELL_TYPES['B'].interact_with_laser(direction, reflected) == []:
         print("Opaque interaction test passed.")
 
     # Test Refract Block Interaction
-    refract_block = Block('refract', (3, 3))
-    refracted_direction = refract_block.interact_with_laser(laser)
-    if refracted_direction == [laser.direction]:
+    if CELL_TYPES['C'].interact_with_laser(direction, reflected) == [direction, reflected]:
         print("Refract interaction test passed.")
 
     # Define file paths
     output_image_path = os.path.join(base_dir, "mad_1_image")
 
-    # Read the .bff file
+    # Read the .bff file and solve it
     grid, blocks, lasers, points = read_bff_file(file_path)
+    sol = Solution(grid, blocks, lasers, points, file_path)
+    sol.search()
 
-    # Convert grid to the format expected by GridImage
-    grid_for_image = [' '.join(row) for row in grid]
-
-    # Create the image
-    grid_image = GridImage(grid_for_image, lasers, points, output_image_path)
+    # Create the image of the solved grid and its laser paths
+    grid_image = GridImage(sol.ans, lasers, points, output_image_path)
     grid_image.build_image()
 
-if os.path.exists(output_image_path + '.png'):
-    print("Image creation successful.")
+    if os.path.exists(output_image_path + '.png'):
+        print("Image creation successful.")
 
                 
@@ -0,0 +1,263 @@
+import os
+import sys
+import copy
+import time
+import random
+import argparse
+from final_version import Solution, PRUNING_RULES, BLOCK_LETTERS
+from engines import ENGINES
+from planner import plan_solution
+from generator import generate_puzzle, format_bff
+from verifier import Verifier
+
+# Name of the plain solvehelper search, with every pruning rule off,
+# that the engines are compared against
+REFERENCE = 'reference'
+
+# Processes given to the engines that take a number of them
+FUZZ_PROCESSES = 2
+
+
+def random_puzzle(rng, max_size=4):
+    '''
+    Makes a small random puzzle. Most are generated around a planted
+    placement, so they have a solution; some are then changed so that
+    they may not: an extra target, a changed block count, or a fixed
+    block of any registered type on a free cell.
+
+    Parameters
+    ----------
+    rng : random.Random
+    max_size : int, optional
+        Largest width and height in cells.
+
+    Returns
+    -------
+    tuple
+        The grid, block counts, lasers and targets, as read_bff_file returns them.
+    '''
+    while True:
+        width, height = rng.randint(2, max_size), rng.randint(2, max_size)
+        blocks = (rng.randint(0, 3), rng.randint(0, 2), rng.randint(0, 1))
+        try:
+            puzzle, _ = generate_puzzle(width, height, blocks, rng.randint(1, 2), rng.randint(1, 3),
+                                        rng.choice((0.0, 0.1, 0.3)), rng.getrandbits(32))
+            break
+        except ValueError:
+            continue
+    grid, blockAvailable, lasers, targets = puzzle
+    change = rng.random()
+    if change < 0.2:
+        targets.append((rng.randint(0, 2 * width), rng.randint(0, 2 * height)))
+    elif change < 0.4:
+        type = rng.randrange(3)
+        blockAvailable[type] = max(0, blockAvailable[type] + rng.choice((1, -1)))
+    elif change < 0.5:
+        free = [(x, y) for x in range(width) for y in range(height) if grid[x][y] == 'o']
+        if free:
+            x, y = rng.choice(free)
+            grid[x][y] = rng.choice(BLOCK_LETTERS)
+    return grid, blockAvailable, lasers, targets
+
+
+def run_engines(puzzle, engines):
+    '''
+    Solves a puzzle with the reference search and with each engine, and
+    checks the answers against each other.
+
+    An answer must pass the verifier. If any run finds a solution, every
+    run must; so when no run finds one, all of them agree the puzzle is
+    unsolvable. Engines that can not solve the puzzle's block types are
+    skipped.
+
+    Parameters
+    ----------
+    puzzle : tuple
+        The grid, block counts, lasers and targets.
+    engines : list of str
+        Keys of engines.ENGINES.
+
+    Returns
+    -------
+    results : dict
+        For each run: 'solved', 'time' and 'nodes'.
+    failures : list of str
+        What went wrong, if anything.
+    '''
+    grid, blockAvailable, lasers, targets = puzzle
+    verifier = Verifier(grid, blockAvailable, lasers, targets)
+    results = {}
+    failures = []
+    for engine in [REFERENCE] + engines:
+        copied = (copy.deepcopy(grid), list(blockAvailable), lasers, targets)
+        if engine == REFERENCE:
+            sol = Solution(*copied, '')
+            sol.rules = dict.fromkeys(PRUNING_RULES, False)
+        else:
+            try:
+                sol = plan_solution(copied, '', engine, FUZZ_PROCESSES)
+            except ValueError:
+                continue
+        t0 = time.perf_counter()
+        try:
+            sol.search()
+        except Exception as exc:
+            failures.append(f"{engine} raised {exc!r}")
+            continue
+        results[engine] = {'solved': sol.ans is not None, 'time': time.perf_counter() - t0,
+                           'nodes': sol.stats['nodes']}
+        if sol.ans is not None:
+            result = verifier.verify(sol.ans)
+            if not result['valid']:
+                reason = result['error'] or f"missed targets {result['missed']}"
+                failures.append(f"{engine} gave an invalid board: {reason}")
+    solved = {engine for engine, result in results.items() if result['solved']}
+    if solved and len(solved) < len(results):
+        failures.append(f"solved by {sorted(solved)} but not by {sorted(set(results) - solved)}")
+    return results, failures
+
+
+def smaller_puzzles(puzzle):
+    '''
+    Yields puzzles one step smaller than a puzzle: with a target, laser or
+    block removed, a cell turned to 'x', or the last column or row cut off.
+    Each step leaves fewer of these, so shrinking always ends.
+
+    Parameters
+    ----------
+    puzzle : tuple
+        The grid, block counts, lasers and targets.
+
+    Returns
+    -------
+    generator of tuple
+    '''
+    grid, blockAvailable, lasers, targets = puzzle
+    if len(targets) > 1:
+        for n in range(len(targets)):
+            yield grid, blockAvailable, lasers, targets[:n] + targets[n + 1:]
+    if len(lasers) > 1:
+        for n in range(len(lasers)):
+            yield grid, blockAvailable, lasers[:n] + lasers[n + 1:], targets
+    for type in range(len(blockAvailable)):
+        if blockAvailable[type]:
+            fewer = list(blockAvailable)
+            fewer[type] -= 1
+            yield grid, fewer, lasers, targets
+    for x in range(len(grid)):
+        for y in range(len(grid[0])):
+            if grid[x][y] != 'x':
+                changed = [list(col) for col in grid]
+                changed[x][y] = 'x'
+                yield changed, blockAvailable, lasers, targets
+    M, N = 2 * len(grid), 2 * len(grid[0])
+    for cut in (grid[:-1], [col[:-1] for col in grid]):
+        if not cut or not cut[0]:
+            continue
+        m, n = 2 * len(cut), 2 * len(cut[0])
+        if (m, n) == (M, N):
+            continue
+        inside = [laser for laser in lasers if laser[0] <= m and laser[1] <= n]
+        points = [point for point in targets if point[0] <= m and point[1] <= n]
+        if inside and points:
+            yield [list(col) for col in cut], blockAvailable, inside, points
+
+
+def shrink(puzzle, engines):
+    '''
+    Shrinks a failing puzzle while it still fails, one step at a time,
+    until no smaller puzzle does.
+
+    Parameters
+    ----------
+    puzzle : tuple
+        The failing puzzle.
+    engines : list of str
+        The engines to run.
+
+    Returns
+    -------
+    tuple
+        The smallest failing puzzle found.
+    '''
+    smaller = True
+    while smaller:
+        smaller = False
+        for candidate in smaller_puzzles(puzzle):
+            if run_engines(candidate, engines)[1]:
+                puzzle = candidate
+                smaller = True
+                break
+    return puzzle
+
+
+def fuzz(count, engines, seed=0, max_size=4, out=None, log=None):
+    '''
+    Runs the engines on random puzzles, summing their times and nodes,
+    and writes each failing case, shrunk, as a '.bff' file.
+
+    Parameters
+    ----------
+    count : int
+        Number of puzzles.
+    engines : list of str
+        Keys of engines.ENGINES.
+    seed : int, optional
+        Seed for the puzzles; the same seed gives the same puzzles.
+    max_size : int, optional
+        Largest width and height in cells.
+    out : str, optional
+        Where to write the failing cases; defaults to the current directory.
+    log : file, optional
+        Where to report failures as they are found.
+
+    Returns
+    -------
+    totals : dict
+        For each run: 'puzzles', 'solved', 'time' and 'nodes'.
+    failed : list of str
+        Paths of the '.bff' files of the failing cases.
+    '''
+    rng = random.Random(seed)
+    totals = {}
+    failed = []
+    for n in range(count):
+        puzzle = random_puzzle(rng, max_size)
+        results, failures = run_engines(puzzle, engines)
+        for engine, result in results.items():
+            total = totals.setdefault(engine, {'puzzles': 0, 'solved': 0, 'time': 0.0, 'nodes': 0})
+            total['puzzles'] += 1
+            total['solved'] += result['solved']
+            total['time'] += result['time']
+            total['nodes'] += result['nodes']
+        if not failures:
+            continue
+        small = shrink(puzzle, engines)
+        comment = '\n'.join([f"Found by fuzz.py, seed {seed}, puzzle {n}"] + run_engines(small, engines)[1])
+        file_path = os.path.join(out or '.', f"fuzz_{seed}_{n}.bff")
+        with open(file_path, 'w') as file:
+            file.write(format_bff(small, comment))
+        failed.append(file_path)
+        if log:
+            print(f"{file_path}: {'; '.join(failures)}", file=log)
+    return totals, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the solver engines on random small puzzles.')
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-size', type=int, default=4, help='largest width and height in cells')
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=list(ENGINES))
+    parser.add_argument('--out', help='where to write shrunk failing cases as .bff files')
+    args = parser.parse_args()
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    totals, failed = fuzz(args.count, args.engines, args.seed, args.max_size, args.out, sys.stderr)
+    print(f"{'engine':12s} {'puzzles':>8s} {'solved':>8s} {'seconds':>9s} {'ms/puzzle':>10s} {'nodes':>10s}")
+    for engine, total in totals.items():
+        print(f"{engine:12s} {total['puzzles']:8d} {total['solved']:8d} {total['time']:9.3f} "
+              f"{1e3 * total['time'] / total['puzzles']:10.2f} {total['nodes']:10d}")
+    print(f"{len(failed)} failing cases")
+    sys.exit(1 if failed else 0)
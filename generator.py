@@ -0,0 +1,162 @@
+import os
+import random
+import argparse
+from final_version import Solution, BLOCK_LETTERS
+
+# Attempts at a puzzle before giving up on its parameters
+MAX_ATTEMPTS = 100
+
+
+def plant(rng, grid, blockAvailable, lasers):
+    '''
+    Places the blocks of a puzzle on free cells, where they change the beams.
+
+    Reflect and refract blocks go one at a time on a free cell the beams
+    cross at that point, so each can bend the path of the next. Opaque
+    blocks go last, away from the beams where possible, so they do not
+    cut the path short.
+
+    Parameters
+    ----------
+    rng : random.Random
+    grid : list of list
+        The empty grid, indexed as grid[x][y]. Blocks are placed in it.
+    blockAvailable : list of int
+        Numbers of each block type: A, B, C.
+    lasers : list of tuple
+        Laser start positions and directions.
+
+    Returns
+    -------
+    None.
+    '''
+    sol = Solution(grid, list(blockAvailable), lasers, [], '')
+    free = {(x, y) for x in range(len(grid)) for y in range(len(grid[0])) if grid[x][y] == 'o'}
+    order = ['A'] * blockAvailable[0] + ['C'] * blockAvailable[2]
+    rng.shuffle(order)
+    for block in order + ['B'] * blockAvailable[1]:
+        crossed = set()
+        sol.tracePaths(crossed)
+        if block == 'B':
+            choices = free - crossed or free
+        else:
+            choices = free & crossed or free
+        x, y = rng.choice(sorted(choices))
+        grid[x][y] = block
+        free.discard((x, y))
+
+
+def generate_puzzle(width, height, blocks=(3, 0, 1), lasers=1, targets=3, fixed=0.1, seed=None):
+    '''
+    Generates a puzzle that is known to have a solution.
+
+    A random grid gets 'x' cells, then random lasers, then the blocks are
+    planted. The targets are picked among the points the planted beams
+    pass through, so the planted placement solves the puzzle.
+
+    Parameters
+    ----------
+    width, height : int
+        Grid size in cells.
+    blocks : tuple of int, optional
+        Numbers of A, B and C blocks.
+    lasers : int, optional
+        Number of lasers.
+    targets : int, optional
+        Number of target points.
+    fixed : float, optional
+        Share of cells that can not hold a block.
+    seed : int, optional
+        Seed for the random choices; the same seed gives the same puzzle.
+
+    Raises
+    ------
+    ValueError
+        If no puzzle with these parameters is found.
+
+    Returns
+    -------
+    tuple
+        The puzzle as read_bff_file returns it, and the planted grid.
+    '''
+    rng = random.Random(seed)
+    M, N = 2 * width, 2 * height
+    for _ in range(MAX_ATTEMPTS):
+        grid = [['x' if rng.random() < fixed else 'o' for _ in range(height)] for _ in range(width)]
+        if sum(col.count('o') for col in grid) < sum(blocks):
+            continue
+
+        # Lasers start on the edge of a cell, as in the bundled levels
+        starts = []
+        while len(starts) < lasers:
+            x, y = rng.randint(0, M), rng.randint(0, N)
+            dx, dy = rng.choice((1, -1)), rng.choice((1, -1))
+            if (x + y) % 2 == 1 and 0 <= x + dx <= M and 0 <= y + dy <= N:
+                starts.append((x, y, dx, dy))
+
+        planted = [list(col) for col in grid]
+        plant(rng, planted, blocks, starts)
+        path = Solution(planted, [0] * len(blocks), starts, [], '').tracePaths()
+        path = {(x, y) for x, y in path if 0 <= x <= M and 0 <= y <= N}
+        path -= {laser[:2] for laser in starts}
+        if len(path) < targets:
+            continue
+        points = rng.sample(sorted(path), targets)
+        return (grid, list(blocks), starts, points), planted
+    raise ValueError(f"no {width}x{height} puzzle found for blocks {blocks}, "
+                     f"{lasers} lasers and {targets} targets")
+
+
+def format_bff(puzzle, comment=None):
+    '''
+    Writes a puzzle in the '.bff' format.
+
+    Parameters
+    ----------
+    puzzle : tuple
+        The grid, blocks, lasers and targets, as read_bff_file returns them.
+    comment : str, optional
+        Put at the top of the file as '#' comment lines.
+
+    Returns
+    -------
+    str
+        The content of the '.bff' file.
+    '''
+    grid, blockAvailable, lasers, targets = puzzle
+    lines = ['# ' + line for line in comment.splitlines()] + [''] if comment else []
+    lines.append('GRID START')
+    lines.extend(' '.join(row) for row in zip(*grid))
+    lines.extend(['GRID STOP', ''])
+    lines.extend(f"{block} {count}" for block, count in zip(BLOCK_LETTERS, blockAvailable) if count)
+    lines.append('')
+    lines.extend('L {} {} {} {}'.format(*laser) for laser in lasers)
+    lines.append('')
+    lines.extend('P {} {}'.format(*point) for point in targets)
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write random solvable .bff files.')
+    parser.add_argument('directory', help='where to write the files')
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--size', default='10x10', help='WIDTHxHEIGHT in cells')
+    parser.add_argument('--blocks', type=int, nargs=3, default=[6, 1, 2], metavar=('A', 'B', 'C'))
+    parser.add_argument('--lasers', type=int, default=2)
+    parser.add_argument('--targets', type=int, default=5)
+    parser.add_argument('--fixed', type=float, default=0.1, help="share of 'x' cells")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    width, height = (int(n) for n in args.size.lower().split('x'))
+    os.makedirs(args.directory, exist_ok=True)
+    for n in range(args.count):
+        seed = args.seed + n
+        puzzle, _ = generate_puzzle(width, height, tuple(args.blocks), args.lasers,
+                                    args.targets, args.fixed, seed)
+        comment = (f"Generated by generator.py: size {width}x{height}, blocks {args.blocks}, "
+                   f"lasers {args.lasers}, targets {args.targets}, fixed {args.fixed}, seed {seed}")
+        file_path = os.path.join(args.directory, f"gen_{width}x{height}_{seed}.bff")
+        with open(file_path, 'w') as file:
+            file.write(format_bff(puzzle, comment))
+        print(file_path)
@@ -0,0 +1,156 @@
+import math
+import itertools
+import tracing
+from final_version import read_bff_file, free_cells, BLOCK_LETTERS, CELL_TYPES, stop_laser
+from engines import ENGINES, PROCESS_ENGINES, CLASSIC_ENGINES, classic_blocks
+
+# Puzzles whose solvehelper tree has at most this many nodes are enumerated
+# directly: at about 5 microseconds a node that is under 10 ms, no slower
+# than the setup of the other engines
+ENUMERATE_NODES = 2000
+
+# Puzzles with more nodes than this race the constraint and beam searches
+PORTFOLIO_NODES = 2000000
+
+
+def estimate_search_space(grid, blockAvailable):
+    '''
+    Estimates how big the brute-force search is for a puzzle.
+    The number of complete placements is the number of ways to put
+    the block multiset into the free cells. The number of nodes counts
+    the partial placements solvehelper visits on the way, leaving out
+    opaque blocks, which it places at the end of a branch.
+
+    Parameters
+    ----------
+    grid : list of list
+        The game grid layout.
+    blockAvailable : list of int
+        Numbers of each block type.
+
+    Returns
+    -------
+    dict
+        The free cell count, the block count, the placement count and
+        the node count.
+    '''
+    free = len(free_cells(grid))
+    blocks = sum(blockAvailable)
+    leaves = 0
+    if blocks <= free:
+        leaves = math.perm(free, blocks)
+        for count in blockAvailable:
+            leaves //= math.factorial(count)
+
+    branched = [count for type, count in enumerate(blockAvailable)
+                if CELL_TYPES[BLOCK_LETTERS[type]].interact is not stop_laser]
+    # Partial placements of k branched blocks in the first d free cells
+    # number comb(d, k) times the orderings of those blocks; summed over
+    # every depth d that is comb(free + 1, k + 1)
+    nodes = 0
+    for used in itertools.product(*(range(count + 1) for count in branched)):
+        placed = sum(used)
+        orders = math.factorial(placed)
+        for count in used:
+            orders //= math.factorial(count)
+        nodes += orders * math.comb(free + 1, placed + 1)
+    return {'free_cells': free, 'blocks': blocks, 'leaves': leaves, 'nodes': nodes}
+
+
+def choose_engine(estimate, classic=True):
+    '''
+    Picks a solver engine from the estimated search cost.
+
+    Small trees are enumerated with no setup cost. Bigger puzzles go to
+    the constraint search, or the beam search for block types it does not
+    know; these cut the tree by the laser paths and stay fast far beyond
+    what enumeration can reach. Each is very slow on some puzzles that the
+    other solves at once, so large puzzles race both, which pays off even
+    on one core. The thresholds come from timings of every engine on
+    bff_files and on generator.py puzzles from 3x3 to 10x10.
+
+    Parameters
+    ----------
+    estimate : dict
+        The result of estimate_search_space.
+    classic : bool, optional
+        False if the puzzle uses block types other than A, B and C,
+        which the constraint engine can not trace.
+
+    Returns
+    -------
+    str
+        A key of engines.ENGINES.
+    '''
+    if estimate['nodes'] <= ENUMERATE_NODES:
+        return 'enumerate'
+    if not classic:
+        return 'beam'
+    if estimate['nodes'] > PORTFOLIO_NODES:
+        return 'portfolio'
+    return 'csp'
+
+
+def plan_solution(puzzle, name, engine=None, processes=None):
+    '''
+    Picks an engine for a parsed puzzle and sets up its Solution.
+    The estimate and the chosen engine are kept in the solve statistics.
+
+    Parameters
+    ----------
+    puzzle : tuple
+        The grid, block counts, lasers and targets from read_bff_file.
+    name : str
+        The file name to save the solution.
+    engine : str, optional
+        Forces an engine instead of letting the planner choose.
+    processes : int, optional
+        Number of processes the solve may use; defaults to the CPU count.
+
+    Raises
+    ------
+    ValueError
+        If the forced engine can not solve puzzles with the block types used.
+
+    Returns
+    -------
+    Solution
+        The unsolved puzzle, ready for solve() or search().
+    '''
+    grid, blockAvailable, lasers, targets = puzzle
+    with tracing.span('plan', puzzle=name):
+        estimate = estimate_search_space(grid, blockAvailable)
+        classic = classic_blocks(grid, blockAvailable)
+        if engine in CLASSIC_ENGINES and not classic:
+            raise ValueError(f"engine '{engine}' only supports blocks {BLOCK_LETTERS[:3]}")
+        engine = engine or choose_engine(estimate, classic)
+        if engine in PROCESS_ENGINES:
+            sol = ENGINES[engine](grid, blockAvailable, lasers, targets, name, processes)
+        else:
+            sol = ENGINES[engine](grid, blockAvailable, lasers, targets, name)
+    sol.stats['estimate'] = estimate
+    sol.stats['engine'] = engine
+    return sol
+
+
+def solve_puzzle(file_path, engine=None, processes=None):
+    '''
+    Reads a puzzle, picks an engine for it and solves it.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the '.bff' file.
+    engine : str, optional
+        Forces an engine instead of letting the planner choose.
+    processes : int, optional
+        Number of processes the solve may use; defaults to the CPU count.
+
+    Returns
+    -------
+    Solution
+        The solved puzzle.
+    '''
+    sol = plan_solution(read_bff_file(file_path), file_path, engine, processes)
+    sol.solve()
+    return sol
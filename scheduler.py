@@ -0,0 +1,332 @@
+import os
+import time
+import copy
+import queue
+import multiprocessing
+from final_version import Solution, BLOCK_LETTERS
+
+# Seconds a busy worker may go between checks for idle workers
+STEAL_LATENCY = 0.005
+
+# Fewest nodes a worker explores between checks
+MIN_POLL_NODES = 64
+
+# Shortest time a donated subtree should take to search at the donor's
+# node rate; smaller ones cost more to hand over than to search
+MIN_TASK_SECONDS = 0.002
+
+# Weight of the newest subtree in each depth's average subtree size
+SIZE_WEIGHT = 0.25
+
+# Seconds the search waits for a message before checking its workers
+POLL_INTERVAL = 0.1
+
+# Marks a stack frame with no choice applied yet
+_UNSET = object()
+
+
+class StealingWorker(Solution):
+    '''
+    One worker of the work-stealing search.
+
+    It walks the solvehelper tree over the free cells with an explicit
+    stack, so that the untried choices of any open cell can be handed to
+    another worker. Every few nodes it checks whether a worker is idle or
+    a solution was found. How many nodes go between checks follows the
+    worker's measured node rate, so checks stay STEAL_LATENCY apart.
+
+    An idle worker is given one of the untried choices nearest the root,
+    which are the biggest subtrees the worker holds. The worker keeps the
+    average size of the subtrees it finished at each depth, and does not
+    give away subtrees that its node rate would search in less than
+    MIN_TASK_SECONDS.
+    '''
+
+    def __init__(self, grid, blockAvailable, lasers, targets, shared, worker_id, rules):
+        super().__init__(grid, blockAvailable, lasers, targets, '')
+        self.rules = rules
+        self.tasks, self.hungry, self.outstanding, self.found, self.results = shared
+        self.worker_id = worker_id
+        self.poll = MIN_POLL_NODES
+        self.rate = 0.0
+        self.sizes = [None] * len(self.freeCells)
+        self.stats.update({'tasks': 0, 'donated': 0, 'busy': 0.0, 'idle': 0.0})
+
+    def options(self, d):
+        '''
+        Lists the choices for the d-th free cell in solvehelper's order:
+        None to leave it empty, then each block type that blockChoices allows.
+
+        Parameters
+        ----------
+        d : int
+            Index of the free cell.
+
+        Returns
+        -------
+        list
+        '''
+        # Opaque blocks left for placeOpaque may also go on cells left empty
+        left = sum(self.blockAvailable[type] for type in range(self.blockType)
+                   if not (self.rules['opaque'] and type in self.opaque))
+        if left > len(self.freeCells) - d:
+            return []
+        return [None] + self.blockChoices(*self.freeCells[d])
+
+    def place(self, d, choice, sign):
+        '''
+        Puts a choice on the d-th free cell (sign 1) or takes it back (sign -1).
+
+        Returns
+        -------
+        None.
+        '''
+        if choice is None:
+            return
+        i, j = self.freeCells[d]
+        self.grid[i][j] = BLOCK_LETTERS[choice] if sign > 0 else 'o'
+        self.blockAvailable[choice] -= sign
+
+    def leaf(self):
+        '''
+        Checks a complete placement and reports it if it is a solution.
+
+        Returns
+        -------
+        None.
+        '''
+        if sum(self.blockAvailable) == 0:
+            if self.checkResult():
+                self.ans = copy.deepcopy(self.grid)
+        elif self.opaqueLeft():
+            self.placeOpaque()
+        if self.ans is not None:
+            self.results.put(('ans', self.ans))
+            self.found.set()
+
+    def donate(self, prefix, stack, wanted):
+        '''
+        Gives one untried choice nearest the root to each idle worker,
+        as long as its subtree is worth handing over.
+
+        Parameters
+        ----------
+        prefix : list of tuple
+            The choices the current task started from.
+        stack : list of list
+            The open frames: free cell index, untried choices, choice
+            applied and the node count when it was applied.
+        wanted : int
+            Number of idle workers.
+
+        Returns
+        -------
+        None.
+        '''
+        smallest = self.rate * MIN_TASK_SECONDS
+        path = list(prefix)
+        for d, untried, applied, _ in stack:
+            # Subtrees only get smaller further down
+            size = self.sizes[d]
+            if size is not None and size < smallest:
+                return
+            while untried and wanted > 0:
+                choice = untried.pop()
+                with self.outstanding.get_lock():
+                    self.outstanding.value += 1
+                self.tasks.put((path + [(d, choice)], d + 1))
+                self.stats['donated'] += 1
+                wanted -= 1
+            if wanted <= 0 or applied is _UNSET:
+                return
+            path.append((d, applied))
+
+    def explore(self, task):
+        '''
+        Searches the subtree of one task.
+
+        Parameters
+        ----------
+        task : tuple
+            The (free cell index, choice) pairs already decided,
+            and the index of the first free cell left to decide.
+
+        Returns
+        -------
+        None.
+        '''
+        prefix, start = task
+        for d, choice in prefix:
+            self.place(d, choice, 1)
+
+        if start == len(self.freeCells):
+            self.stats['nodes'] += 1
+            self.leaf()
+            stack = []
+        else:
+            stack = [[start, self.options(start), _UNSET, 0]]
+        stats, sizes = self.stats, self.sizes
+        count = 0
+        clock = time.perf_counter()
+        while stack and self.ans is None:
+            frame = stack[-1]
+            if frame[2] is not _UNSET:
+                self.place(frame[0], frame[2], -1)
+                frame[2] = _UNSET
+                size = stats['nodes'] - frame[3]
+                average = sizes[frame[0]]
+                sizes[frame[0]] = size if average is None else average + (size - average) * SIZE_WEIGHT
+            if not frame[1]:
+                stack.pop()
+                continue
+            d = frame[0]
+            choice = frame[1].pop(0)
+            self.place(d, choice, 1)
+            frame[2] = choice
+            frame[3] = stats['nodes']
+            stats['nodes'] += 1
+
+            if d + 1 == len(self.freeCells):
+                self.leaf()
+            else:
+                stack.append([d + 1, self.options(d + 1), _UNSET, 0])
+
+            count += 1
+            if count >= self.poll:
+                # The shared flags take a lock, so they are only read here
+                if self.found.is_set():
+                    break
+                now = time.perf_counter()
+                self.rate = count / max(now - clock, 1e-9)
+                self.poll = max(MIN_POLL_NODES, int(self.rate * STEAL_LATENCY))
+                count, clock = 0, now
+                wanted = self.hungry.value
+                if wanted > 0:
+                    self.donate(prefix, stack, wanted)
+
+        # Undo what is still placed if the search stopped early
+        for frame in reversed(stack):
+            if frame[2] is not _UNSET:
+                self.place(frame[0], frame[2], -1)
+        for d, choice in reversed(prefix):
+            self.place(d, choice, -1)
+
+    def run(self):
+        '''
+        Takes tasks until the search is exhausted or a solution is found,
+        then reports the worker's statistics.
+
+        Returns
+        -------
+        None.
+        '''
+        while not self.found.is_set():
+            with self.hungry.get_lock():
+                self.hungry.value += 1
+            t0 = time.perf_counter()
+            task = None
+            while task is None and self.outstanding.value > 0 and not self.found.is_set():
+                try:
+                    task = self.tasks.get(timeout=0.01)
+                except queue.Empty:
+                    pass
+            with self.hungry.get_lock():
+                self.hungry.value -= 1
+            t1 = time.perf_counter()
+            self.stats['idle'] += t1 - t0
+            if task is None:
+                break
+
+            self.explore(task)
+            self.stats['tasks'] += 1
+            self.stats['busy'] += time.perf_counter() - t1
+            with self.outstanding.get_lock():
+                self.outstanding.value -= 1
+
+        total = self.stats['busy'] + self.stats['idle']
+        self.stats['utilization'] = self.stats['busy'] / total if total else 0.0
+        self.results.put(('stats', self.worker_id, self.stats))
+        # Tasks donated but never taken are not needed; do not wait on exit
+        # for them to be delivered
+        self.tasks.cancel_join_thread()
+
+
+def _run_worker(grid, blockAvailable, lasers, targets, shared, worker_id, rules):
+    StealingWorker(grid, blockAvailable, lasers, targets, shared, worker_id, rules).run()
+
+
+class StealingSolution(Solution):
+    '''
+    Searches the solvehelper tree in a pool of processes that share work
+    by stealing, instead of a fixed split of the first few cells.
+    The statistics list each worker's nodes, donated tasks and utilization.
+    '''
+
+    def __init__(self, grid, blockAvailable, lasers, targets, name, processes=None):
+        super().__init__(grid, blockAvailable, lasers, targets, name)
+        self.processes = processes or os.cpu_count() or 1
+
+    def search(self):
+        '''
+        Runs the work-stealing search.
+
+        Raises
+        ------
+        RuntimeError
+            If a worker process dies before reporting. The other workers
+            are stopped, since the dead worker's task is lost.
+
+        Returns
+        -------
+        None.
+        '''
+        ctx = multiprocessing.get_context()
+        tasks = ctx.Queue()
+        results = ctx.Queue()
+        shared = (tasks, ctx.Value('i', 0), ctx.Value('i', 1), ctx.Event(), results)
+        tasks.put(([], 0))
+
+        workers = [ctx.Process(target=_run_worker, args=(self.grid, self.blockAvailable, self.laserQueue,
+                                                          self.targets, shared, n, self.rules))
+                   for n in range(self.processes)]
+        for worker in workers:
+            worker.start()
+
+        reports = {}
+        dead = []
+        while len(reports) < len(workers):
+            try:
+                message = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # A worker reports before it exits, so one that exited
+                # without a report after a quiet poll has died
+                dead = [n for n, worker in enumerate(workers)
+                        if worker.exitcode is not None and n not in reports]
+                if dead:
+                    break
+                continue
+            if message[0] == 'ans':
+                if self.ans is None:
+                    self.ans = message[1]
+                    self.terminate = True
+            else:
+                reports[message[1]] = message[2]
+
+        if dead:
+            shared[3].set()
+        tasks.cancel_join_thread()
+        for worker in workers:
+            worker.join(POLL_INTERVAL * 10 if dead else None)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        if dead:
+            codes = {n: workers[n].exitcode for n in dead}
+            raise RuntimeError(f"stealing workers died with exit codes {codes}")
+
+        self.stats['workers'] = [reports[n] for n in range(len(workers))]
+        for report in self.stats['workers']:
+            self.stats['nodes'] += report['nodes']
+            self.stats['checks'] += report['checks']
+            for rule, count in report['pruned'].items():
+                self.stats['pruned'][rule] += count
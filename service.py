@@ -0,0 +1,388 @@
+import os
+import json
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from final_version import parse_bff, puzzle_key, BffFormatError
+
+# Longest time a request waits for a place in a full queue
+QUEUE_TIMEOUT = 5.0
+
+# Largest request body accepted, in bytes
+MAX_BODY = 1 << 20
+
+
+def solve_text(text):
+    '''
+    Solves the content of a '.bff' file in a worker process.
+
+    Parameters
+    ----------
+    text : str
+        Content of a '.bff' file.
+
+    Returns
+    -------
+    dict
+        Whether a solution was found, the placed grid row by row,
+        and the solve statistics.
+    '''
+    from planner import plan_solution
+
+    # Each worker is one process of the pool, so it never starts its own
+    sol = plan_solution(parse_bff(text), '<service>', processes=1)
+    sol.search()
+    return {'solved': sol.ans is not None, 'grid': sol.ansRows(), 'stats': sol.stats}
+
+
+def warm_up():
+    '''
+    Imports the solver modules in a worker process.
+
+    Returns
+    -------
+    None.
+    '''
+    import planner
+
+
+class Job:
+    '''
+    One puzzle being solved, shared by every request for the same content.
+    '''
+
+    def __init__(self, key, text, future):
+        self.key = key
+        self.text = text
+        self.future = future
+        self.waiters = 0
+        self.started = False
+        self.cancelled = False
+
+
+class SolveService:
+    '''
+    A local solve service over HTTP or a Unix socket.
+
+    Requests for a puzzle that is already queued or running wait for that
+    solve instead of starting another. The queue is bounded: a request
+    that can not get a place within QUEUE_TIMEOUT seconds gets a 503.
+    A queued job whose clients have all disconnected is dropped before it
+    reaches the pool; a job already running finishes, but nobody waits for it.
+    '''
+
+    def __init__(self, processes=None, queue_size=64):
+        '''
+        Sets up the service.
+
+        Parameters
+        ----------
+        processes : int, optional
+            Number of solver processes; defaults to the CPU count.
+        queue_size : int, optional
+            Number of distinct puzzles that may wait for a process.
+
+        Returns
+        -------
+        None.
+        '''
+        self.processes = processes or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.inflight = {}
+        self.stats = {'requests': 0, 'solves': 0, 'coalesced': 0, 'rejected': 0, 'cancelled': 0}
+
+    async def start(self, host='127.0.0.1', port=8765, unix_path=None):
+        '''
+        Starts the process pool and the server.
+
+        Parameters
+        ----------
+        host : str, optional
+            Address to listen on.
+        port : int, optional
+            Port to listen on; 0 picks a free port.
+        unix_path : str, optional
+            Listen on this Unix socket instead of TCP.
+
+        Returns
+        -------
+        asyncio.Server
+        '''
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.pool = ProcessPoolExecutor(self.processes)
+        await asyncio.gather(*(loop.run_in_executor(self.pool, warm_up)
+                               for _ in range(self.processes)))
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.processes)]
+        if unix_path:
+            self.server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def stop(self):
+        '''
+        Stops the server, the dispatchers and the process pool.
+
+        Returns
+        -------
+        None.
+        '''
+        self.server.close()
+        await self.server.wait_closed()
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.pool.shutdown(cancel_futures=True)
+
+    async def dispatch(self):
+        '''
+        Hands queued jobs to the process pool, one at a time.
+
+        Returns
+        -------
+        None.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            if job.cancelled:
+                continue
+            job.started = True
+            self.stats['solves'] += 1
+            try:
+                result = await loop.run_in_executor(self.pool, solve_text, job.text)
+            except Exception as exc:
+                result = {'error': f"{type(exc).__name__}: {exc}"}
+            finally:
+                self.inflight.pop(job.key, None)
+            if not job.future.done():
+                job.future.set_result(result)
+
+    async def submit(self, text, disconnected):
+        '''
+        Solves a puzzle, joining an identical job that is already in flight.
+
+        Parameters
+        ----------
+        text : str
+            Content of a '.bff' file.
+        disconnected : asyncio.Future
+            Done when the client goes away.
+
+        Returns
+        -------
+        tuple
+            The HTTP status and the JSON response.
+        '''
+        try:
+            key = puzzle_key(parse_bff(text, '<request>'))
+        except BffFormatError as exc:
+            return 400, {'error': str(exc)}
+
+        job = self.inflight.get(key)
+        if job is None:
+            job = Job(key, text, asyncio.get_running_loop().create_future())
+            self.inflight[key] = job
+            enqueue = True
+        else:
+            self.stats['coalesced'] += 1
+            enqueue = False
+
+        # The request that queues the job waits on it while it waits for
+        # a place, so requests that join it and leave never cancel it
+        job.waiters += 1
+        try:
+            if enqueue:
+                try:
+                    await asyncio.wait_for(self.queue.put(job), QUEUE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self.inflight.pop(key, None)
+                    job.cancelled = True
+                    self.stats['rejected'] += 1
+                    result = {'error': 'solver queue is full'}
+                    job.future.set_result(result)
+                    return 503, result
+            await asyncio.wait([job.future, disconnected], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            job.waiters -= 1
+        if not job.future.done():
+            if job.waiters == 0 and not job.started:
+                job.cancelled = True
+                self.inflight.pop(key, None)
+                job.future.set_result({'error': 'cancelled'})
+                self.stats['cancelled'] += 1
+            return None, None
+        result = job.future.result()
+        if job.cancelled:
+            return 503, result
+        return (500 if 'error' in result else 200), result
+
+    async def wait_closed(self, reader):
+        '''
+        Waits until the client closes its side of the connection.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+
+        Returns
+        -------
+        None.
+        '''
+        while await reader.read(1024):
+            pass
+
+    async def handle(self, reader, writer):
+        '''
+        Serves one HTTP request and closes the connection, whether or not
+        a response is sent.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+        writer : asyncio.StreamWriter
+
+        Returns
+        -------
+        None.
+        '''
+        self.stats['requests'] += 1
+        try:
+            status, body = await self.respond(reader)
+            if status is None:
+                return
+            payload = json.dumps(body).encode()
+            writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                         f"Content-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+        '''
+        Reads one HTTP request and works out its response.
+        POST /solve takes '.bff' content and returns the placed grid as JSON;
+        GET /status returns the service counters.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+
+        Returns
+        -------
+        tuple
+            The HTTP status and the JSON body, or (None, None) if the
+            client disconnected before its puzzle was solved.
+        '''
+        try:
+            request = await reader.readline()
+            method, target, _ = request.decode('latin-1').split(' ', 2)
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            if length > MAX_BODY:
+                return 413, {'error': 'request body too large'}
+            if method == 'POST' and target == '/solve':
+                text = (await reader.readexactly(length)).decode('utf-8')
+                disconnected = asyncio.ensure_future(self.wait_closed(reader))
+                try:
+                    return await self.submit(text, disconnected)
+                finally:
+                    disconnected.cancel()
+            if method == 'GET' and target == '/status':
+                return 200, dict(self.stats, queued=self.queue.qsize(), in_flight=len(self.inflight))
+            return 404, {'error': 'unknown endpoint'}
+        except (ValueError, UnicodeDecodeError, asyncio.IncompleteReadError):
+            return 400, {'error': 'malformed request'}
+
+
+async def self_check():
+    '''
+    Checks coalescing under backpressure without a process pool: with the
+    queue full, a request waits for a place while a second request for the
+    same puzzle joins it and disconnects. The first must still get its
+    answer. A queued job whose only client leaves must be cancelled.
+
+    Returns
+    -------
+    list of str
+        What went wrong, if anything.
+    '''
+    with open(os.path.join('bff_files', 'tiny_5.bff')) as file:
+        text = file.read()
+    loop = asyncio.get_running_loop()
+    service = SolveService(1, queue_size=1)
+    service.queue = asyncio.Queue(1)
+    failures = []
+
+    filler = Job(None, '', loop.create_future())
+    await service.queue.put(filler)
+    first = asyncio.create_task(service.submit(text, loop.create_future()))
+    await asyncio.sleep(0)
+    gone = loop.create_future()
+    second = asyncio.create_task(service.submit(text, gone))
+    await asyncio.sleep(0)
+    gone.set_result(None)
+    if await second != (None, None):
+        failures.append("the disconnected request got a response")
+    await service.queue.get()
+    await asyncio.sleep(0)
+    job = await service.queue.get()
+    if job.cancelled or service.stats['cancelled']:
+        failures.append(f"a job with a connected client was cancelled: {service.stats}")
+    # Finish the job the way dispatch does
+    service.inflight.pop(job.key, None)
+    if not job.future.done():
+        job.future.set_result({'solved': True})
+    status, _ = await first
+    if status != 200:
+        failures.append(f"the connected request got status {status}")
+
+    gone = loop.create_future()
+    alone = asyncio.create_task(service.submit(text, gone))
+    await asyncio.sleep(0)
+    job = await service.queue.get()
+    gone.set_result(None)
+    if await alone != (None, None) or not job.cancelled or job.key in service.inflight:
+        failures.append("a queued job whose client left was not cancelled")
+    return failures
+
+
+async def main(args):
+    service = SolveService(args.processes, args.queue_size)
+    await service.start(args.host, args.port, args.unix)
+    print(f"Solve service listening on {args.unix or f'{args.host}:{args.port}'}")
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local Lazor solve service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--queue-size', type=int, default=64)
+    parser.add_argument('--check', action='store_true', help='run the self-check and exit')
+    args = parser.parse_args()
+
+    if args.check:
+        failed = asyncio.run(asyncio.wait_for(self_check(), 4 * QUEUE_TIMEOUT))
+        if not failed:
+            print("Solve service self-check passed.")
+        else:
+            print(f"Solve service self-check failed: {failed}")
+    else:
+        asyncio.run(main(args))
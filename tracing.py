@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import threading
+
+# Calls of checkResult grouped into one trace event
+CHECK_BATCH = 1000
+
+# Whether spans are being recorded in this process
+enabled = False
+
+_events = []
+_checks = None
+
+
+class _Span:
+    '''
+    Records the time spent in a with-block as a complete event.
+    '''
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _events.append({'name': self.name, 'cat': 'solver', 'ph': 'X',
+                        'ts': self.start * 1e6, 'dur': (time.perf_counter() - self.start) * 1e6,
+                        'pid': os.getpid(), 'tid': threading.get_ident(), 'args': self.args})
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_span = _NoSpan()
+
+
+def enable():
+    '''
+    Starts recording trace events in this process.
+
+    Returns
+    -------
+    None.
+    '''
+    global enabled
+    enabled = True
+
+
+def span(name, **args):
+    '''
+    Times a with-block as a trace event. Costs next to nothing while
+    tracing is not enabled.
+
+    Parameters
+    ----------
+    name : str
+        The name of the event.
+    **args
+        Values shown with the event, such as the puzzle name.
+
+    Returns
+    -------
+    context manager
+    '''
+    return _Span(name, args) if enabled else _no_span
+
+
+def check_done(start):
+    '''
+    Counts one checkResult call into the current batch, and records the
+    batch once it holds CHECK_BATCH calls. The batch event covers the time
+    from its first call to its last; its arguments give the number of calls
+    and the time spent inside them.
+
+    Parameters
+    ----------
+    start : float
+        time.perf_counter() when the call started.
+
+    Returns
+    -------
+    None.
+    '''
+    global _checks
+    end = time.perf_counter()
+    if _checks is None:
+        _checks = [start, end, 0, 0.0]
+    _checks[1] = end
+    _checks[2] += 1
+    _checks[3] += end - start
+    if _checks[2] >= CHECK_BATCH:
+        _flush_checks()
+
+
+def _flush_checks():
+    global _checks
+    if _checks is not None:
+        first, last, count, inside = _checks
+        _events.append({'name': 'checkResult', 'cat': 'solver', 'ph': 'X',
+                        'ts': first * 1e6, 'dur': (last - first) * 1e6,
+                        'pid': os.getpid(), 'tid': threading.get_ident(),
+                        'args': {'checks': count, 'check_time': inside}})
+        _checks = None
+
+
+def drain():
+    '''
+    Takes the events recorded so far in this process.
+
+    Returns
+    -------
+    list of dict
+        The events, in Chrome Trace Event format.
+    '''
+    _flush_checks()
+    events = _events[:]
+    _events.clear()
+    return events
+
+
+def write_trace(file_path, events):
+    '''
+    Writes events as a Chrome Trace Event file, naming each process,
+    for chrome://tracing or Perfetto.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the '.json' trace file.
+    events : list of dict
+        Events from drain(), from any number of processes.
+
+    Returns
+    -------
+    None.
+    '''
+    main = os.getpid()
+    names = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+              'args': {'name': 'main' if pid == main else f"worker {pid}"}}
+             for pid in sorted({event['pid'] for event in events} | {main})]
+    with open(file_path, 'w') as file:
+        json.dump({'traceEvents': names + events, 'displayTimeUnit': 'ms'}, file)
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import argparse
+from final_version import read_bff_file, laser_table, SegmentGraph, BLOCK_LETTERS
+
+
+def read_solution_file(file_path):
+    '''
+    Reads a board written by Solution.printAns.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the '_solution.txt' file.
+
+    Returns
+    -------
+    list of list or None
+        The board indexed as board[x][y], or None if the file says
+        no solution was found.
+    '''
+    with open(file_path) as file:
+        rows = [line.split() for line in file if line.strip()]
+    if rows and rows[0][0] == 'No':
+        return None
+    return [list(col) for col in zip(*rows)]
+
+
+class Verifier:
+    '''
+    Checks candidate boards for one puzzle without searching.
+
+    The lasers are traced by jumps over the puzzle's SegmentGraph, built
+    once, so checking a board is a walk over flat tables.
+    '''
+
+    def __init__(self, grid, blockAvailable, lasers, targets):
+        '''
+        Looks up the laser moves for a puzzle.
+
+        Parameters
+        ----------
+        grid : list of list
+            The puzzle grid, indexed as grid[x][y].
+        blockAvailable : list of int
+            Numbers of each block type: A, B, C, then any other registered types.
+        lasers : list of tuple
+            Laser start positions and directions.
+        targets : list of tuple
+            Target points.
+
+        Returns
+        -------
+        None.
+        '''
+        self.grid = grid
+        self.blockAvailable = list(blockAvailable)
+        self.targets = targets
+        self.table = laser_table(len(grid), len(grid[0]))
+        self.segments = SegmentGraph(self.table, grid, lasers, targets)
+
+    def check_blocks(self, board):
+        '''
+        Checks that a board only adds blocks on free cells, and uses
+        exactly the blocks available.
+
+        Parameters
+        ----------
+        board : list of list
+            The candidate board, indexed as board[x][y].
+
+        Returns
+        -------
+        str or None
+            What is wrong with the board, or None if it is fine.
+        '''
+        if len(board) != len(self.grid) or any(len(col) != len(self.grid[0]) for col in board):
+            return 'board size does not match the puzzle'
+        used = [0] * len(self.blockAvailable)
+        for x, col in enumerate(board):
+            for y, cell in enumerate(col):
+                fixed = self.grid[x][y]
+                if cell == fixed:
+                    continue
+                type = BLOCK_LETTERS.index(cell) if cell in BLOCK_LETTERS else len(used)
+                if fixed != 'o' or type >= len(used):
+                    return f"cell ({x}, {y}) can not change from '{fixed}' to '{cell}'"
+                used[type] += 1
+        if used != self.blockAvailable:
+            return f"blocks used {used}, expected {self.blockAvailable}"
+        return None
+
+    def missed(self, board):
+        '''
+        Traces the lasers on a board.
+
+        Parameters
+        ----------
+        board : list of list
+            The board, indexed as board[x][y].
+
+        Returns
+        -------
+        list of tuple
+            The targets no laser reaches.
+        '''
+        hit = self.segments.covers(self.table.board(board))
+        return [point for n, point in enumerate(self.targets) if not hit >> n & 1]
+
+    def verify(self, board):
+        '''
+        Verifies one candidate board.
+
+        Parameters
+        ----------
+        board : list of list or None
+            The candidate board, indexed as board[x][y].
+
+        Returns
+        -------
+        dict
+            'valid', the list of 'missed' targets and the 'error' found
+            in the board, if any.
+        '''
+        if board is None:
+            return {'valid': False, 'missed': list(self.targets), 'error': 'no board'}
+        error = self.check_blocks(board)
+        if error is not None:
+            return {'valid': False, 'missed': [], 'error': error}
+        missed = self.missed(board)
+        return {'valid': not missed, 'missed': missed, 'error': None}
+
+    def verify_many(self, boards):
+        '''
+        Verifies many candidate boards.
+
+        Parameters
+        ----------
+        boards : iterable of list
+            The candidate boards, indexed as board[x][y].
+
+        Returns
+        -------
+        list of dict
+            The result of verify for each board.
+        '''
+        return [self.verify(board) for board in boards]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check solved boards against a puzzle.')
+    parser.add_argument('puzzle', help='the .bff file')
+    parser.add_argument('boards', nargs='*', help='_solution.txt files; defaults to the puzzle\'s own')
+    parser.add_argument('--json', action='store_true', help='print one JSON result per line')
+    args = parser.parse_args()
+
+    verifier = Verifier(*read_bff_file(args.puzzle))
+    boards = args.boards or [os.path.splitext(args.puzzle)[0] + '_solution.txt']
+    failed = 0
+    for board_path in boards:
+        try:
+            result = verifier.verify(read_solution_file(board_path))
+        except (OSError, UnicodeDecodeError) as exc:
+            result = {'valid': False, 'missed': [], 'error': str(exc)}
+        failed += not result['valid']
+        if args.json:
+            print(json.dumps(dict(result, board=board_path)))
+        elif result['valid']:
+            print(f"{board_path}: pass")
+        else:
+            reason = result['error'] or f"missed targets {result['missed']}"
+            print(f"{board_path}: fail, {reason}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,213 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from final_version import read_bff_file, puzzle_key, solve_and_render, BffFormatError
+
+# Seconds between directory scans
+POLL_INTERVAL = 0.5
+
+# Seconds a file must stay unchanged before it is solved
+DEBOUNCE = 1.0
+
+
+def rebuild(file_path, render):
+    '''
+    Solves one puzzle, writing its _solution.txt and, if asked, its image.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the '.bff' file.
+    render : bool
+        Whether to save an image of the solution too.
+
+    Returns
+    -------
+    tuple
+        Whether a solution was found and the seconds it took.
+    '''
+    t0 = time.time()
+    sol = solve_and_render(file_path, render)
+    return sol.ans is not None, time.time() - t0
+
+
+class Watcher:
+    '''
+    Watches a directory of '.bff' files and re-solves the puzzles that change.
+
+    A file is solved once it has been left alone for the debounce time, so
+    a burst of saves leads to one solve. Its parsed content is hashed, and
+    the solve is skipped when the grid, blocks, lasers and targets are the
+    same as last time, e.g. after an edit to comments only. At most one solve
+    per worker process is in flight; other changed files wait their turn.
+    '''
+
+    def __init__(self, directory, processes=None, render=True, debounce=DEBOUNCE):
+        '''
+        Sets up the watcher.
+
+        Parameters
+        ----------
+        directory : str
+            The directory to watch.
+        processes : int, optional
+            Number of solver processes; defaults to the CPU count.
+        render : bool, optional
+            Whether to save solution images as well.
+        debounce : float, optional
+            Seconds a file must stay unchanged before it is solved.
+
+        Returns
+        -------
+        None.
+        '''
+        self.directory = directory
+        self.processes = processes or os.cpu_count() or 1
+        self.render = render
+        self.debounce = debounce
+        self.signatures = {}
+        self.changed = {}
+        self.keys = {}
+        self.running = {}
+        self.stats = {'solved': 0, 'skipped': 0, 'errors': 0}
+
+    def scan(self, now):
+        '''
+        Notes the files that appeared or changed since the last scan,
+        and forgets the ones that were removed.
+
+        Parameters
+        ----------
+        now : float
+            The current time.
+
+        Returns
+        -------
+        None.
+        '''
+        seen = set()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.bff'):
+                continue
+            file_path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            seen.add(file_path)
+            signature = (info.st_mtime_ns, info.st_size)
+            if self.signatures.get(file_path) != signature:
+                self.signatures[file_path] = signature
+                self.changed[file_path] = now
+        for file_path in list(self.signatures):
+            if file_path not in seen:
+                del self.signatures[file_path]
+                self.changed.pop(file_path, None)
+                self.keys.pop(file_path, None)
+
+    def submit(self, pool, file_path):
+        '''
+        Parses a changed file and starts a solve if its puzzle changed.
+
+        Parameters
+        ----------
+        pool : concurrent.futures.Executor
+        file_path : str
+
+        Returns
+        -------
+        None.
+        '''
+        try:
+            key = puzzle_key(read_bff_file(file_path))
+        except (OSError, UnicodeDecodeError, BffFormatError) as exc:
+            self.stats['errors'] += 1
+            print(f"Error: {exc}")
+            return
+        if self.keys.get(file_path) == key:
+            self.stats['skipped'] += 1
+            return
+        self.keys[file_path] = key
+        self.running[file_path] = pool.submit(rebuild, file_path, self.render)
+
+    def collect(self):
+        '''
+        Reports the solves that finished.
+
+        Returns
+        -------
+        None.
+        '''
+        for file_path, future in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[file_path]
+            name = os.path.basename(file_path)
+            try:
+                solved, seconds = future.result()
+            except Exception as exc:
+                # Try again on the next change
+                self.keys.pop(file_path, None)
+                self.stats['errors'] += 1
+                print(f"File: {name}, Error: {exc}")
+                continue
+            self.stats['solved'] += 1
+            print(f"File: {name}, Solved: {solved}, Time: {seconds} seconds")
+
+    def step(self, pool, now):
+        '''
+        Runs one round: scan, collect finished solves, start new ones.
+
+        Parameters
+        ----------
+        pool : concurrent.futures.Executor
+        now : float
+            The current time.
+
+        Returns
+        -------
+        None.
+        '''
+        self.scan(now)
+        self.collect()
+        for file_path, changed in sorted(self.changed.items(), key=lambda item: item[1]):
+            if len(self.running) >= self.processes:
+                break
+            if now - changed < self.debounce or file_path in self.running:
+                continue
+            del self.changed[file_path]
+            self.submit(pool, file_path)
+
+    def run(self, interval=POLL_INTERVAL):
+        '''
+        Watches the directory until interrupted.
+
+        Parameters
+        ----------
+        interval : float, optional
+            Seconds between scans.
+
+        Returns
+        -------
+        None.
+        '''
+        with ProcessPoolExecutor(self.processes) as pool:
+            try:
+                while True:
+                    self.step(pool, time.monotonic())
+                    time.sleep(interval)
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-solve .bff files as they change.')
+    parser.add_argument('directory', nargs='?', default='bff_files')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL)
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE)
+    parser.add_argument('--no-render', action='store_true', help='only write _solution.txt files')
+    args = parser.parse_args()
+    print(f"Watching {os.path.abspath(args.directory)}")
+    Watcher(args.directory, args.processes, not args.no_render, args.debounce).run(args.interval)